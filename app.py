@@ -1,18 +1,27 @@
-import glob
+import math
 import os
+import time
+import urllib.parse
+import uuid
 
 import dash
 import dash_auth
 import dash_bootstrap_components as dbc
 import dash_uploader as du
-import pandas as pd
+import flask
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
+import config
 from pages import home, page1, page2, page3, page4
+from utils.cache import invalidate_path
+from utils.catalog import catalog, file_label
+from utils.download import csv_response, iter_csv, iter_file
+from utils.ingest import ensure_ingested, recent_statuses, submit_ingest
+from utils.preview import is_approximate
+from utils.sidecar import remove_sidecars
 
-uploaded_files_dict = {}
 page_layouts = {
     "/": home.layout,
     "/page1": page1.layout,
@@ -29,12 +38,11 @@ app = dash.Dash(
 app.title = "テストページ"
 passPair = {"User1": "AAA", "User2": "BBB"}
 auth = dash_auth.BasicAuth(app, passPair)
-du.configure_upload(app, r"/usr/src/data")
+du.configure_upload(app, config.UPLOAD_DIR)
 
-
-for filepath in glob.glob("data/*/*"):
-    filename = os.path.basename(filepath)
-    uploaded_files_dict[filename] = filepath
+# 起動時に前回から変更のあったファイルだけをカタログに反映する
+catalog.scan(config.DATA_DIR)
+latest_files, _ = catalog.search(None, 1, 1)
 
 sidebar = html.Div(
     [
@@ -71,13 +79,26 @@ sidebar = html.Div(
                     cancel_button=True,
                 ),
                 html.Br(),
-                html.Div("input_info"),
-                dbc.Select(
+                html.Div(id="ingest-status", style={"margin": "1vh 0 1vh 0"}),
+                dcc.Interval(id="ingest-interval", interval=2000, disabled=True),
+                dcc.Store(id="catalog-version", data=0),
+                dcc.Dropdown(
                     id="uploaded-files-dropdown",
                     options=[
-                        {"label": i, "value": i} for i in uploaded_files_dict.keys()
+                        {"label": file_label(row), "value": row["path"]}
+                        for row in latest_files
                     ],
-                    value=next(iter(uploaded_files_dict.keys()), None),
+                    value=latest_files[0]["path"] if latest_files else None,
+                    placeholder="ファイル名で検索",
+                    clearable=False,
+                ),
+                dbc.Pagination(
+                    id="file-pagination",
+                    max_value=1,
+                    active_page=1,
+                    fully_expanded=False,
+                    size="sm",
+                    style={"margin": "1vh 0 0 0"},
                 ),
                 dbc.Button(
                     id="file-select-button",
@@ -107,14 +128,24 @@ sidebar = html.Div(
                     type="text",
                     placeholder="出力ファイルの名前",
                 ),
+                dbc.Checklist(
+                    id="download-options",
+                    options=[
+                        {"label": "gzip圧縮", "value": "gzip"},
+                        {"label": "加工後のデータ", "value": "edited"},
+                    ],
+                    value=[],
+                    switch=True,
+                    style={"margin": "1vh 0 0 0"},
+                ),
                 dbc.Button(
                     "Download Data",
                     id="download-button",
                     style={"margin": "3vh 0 3vh 0"},
                     className="text-white",
                     color="secondary",
+                    external_link=True,
                 ),
-                dcc.Download(id="download-csv"),
                 html.Hr(),
                 dbc.Modal(
                     [
@@ -149,31 +180,45 @@ sidebar = html.Div(
 
 content = html.Div(id="page-content")
 
-app.layout = dbc.Container(
-    [
-        dbc.Row(
-            [
-                dcc.Location(id="url", refresh=False),
-                dcc.Store(id="shared-selected-df", storage_type="session"),
-                dbc.Col(
-                    [
-                        dbc.Row(sidebar),
-                    ],
-                    className="bg-light",
-                    width=2,
-                    id="sidebar",
-                ),
-                dbc.Col(
-                    content,
-                    id="content",
-                    width=10,
-                ),
-            ],
-            justify="start",
-        )
-    ],
-    fluid=True,
-)
+
+# ページを開くたびにセッションIDを発行する (既にあればブラウザ側の値が優先される)
+def serve_layout():
+    return dbc.Container(
+        [
+            dbc.Row(
+                [
+                    dcc.Location(id="url", refresh=False),
+                    dcc.Store(id="shared-selected-df", storage_type="session"),
+                    # 大きなファイルの概算表示から正確な集計に切り替えるための状態
+                    dcc.Store(id="preview-ready"),
+                    dcc.Interval(id="preview-interval", interval=2000, disabled=True),
+                    dcc.Store(
+                        id="session-id",
+                        storage_type="session",
+                        data=str(uuid.uuid4()),
+                    ),
+                    dbc.Col(
+                        [
+                            dbc.Row(sidebar),
+                        ],
+                        className="bg-light",
+                        width=2,
+                        id="sidebar",
+                    ),
+                    dbc.Col(
+                        content,
+                        id="content",
+                        width=10,
+                    ),
+                ],
+                justify="start",
+            )
+        ],
+        fluid=True,
+    )
+
+
+app.layout = serve_layout
 
 
 @app.callback([Output("page-content", "children")], [Input("url", "pathname")])
@@ -209,30 +254,87 @@ def toggle_sidebar(n_clicks):
 
 
 @du.callback(
-    output=Output(
-        "uploaded-files-dropdown",
-        "options",
-        allow_duplicate=True,
-    ),
+    output=[
+        Output("catalog-version", "data", allow_duplicate=True),
+        Output("ingest-interval", "disabled", allow_duplicate=True),
+    ],
     id="input",
 )
 def callback_on_completion(status: du.UploadStatus):
     for x in status.uploaded_files:
-        filename = os.path.basename(str(x))
-        uploaded_files_dict[filename] = str(x)
-    uploaded_files = list(uploaded_files_dict.keys())
-    return [{"label": i, "value": i} for i in uploaded_files]
+        catalog.register(str(x))
+        # 変換・集計はバックグラウンドで行う
+        submit_ingest(str(x))
+    return time.time(), False
 
 
+# 選択したファイルの正確な集計が済むまで確認を続け、済んだら各ページに知らせる
 @app.callback(
-    Output("uploaded-files-dropdown", "options"),
+    Output("preview-interval", "disabled"),
+    Output("preview-ready", "data"),
+    Output("ingest-interval", "disabled", allow_duplicate=True),
+    Input("shared-selected-df", "data"),
+    Input("preview-interval", "n_intervals"),
+    prevent_initial_call=True,
+)
+def update_preview_state(data, n_intervals):
+    if is_approximate(data):
+        ensure_ingested(data)
+        return False, dash.no_update, False
+    ctx = dash.callback_context
+    trigger_id = ctx.triggered[0]["prop_id"].split(".")[0] if ctx.triggered else ""
+    if trigger_id == "preview-interval":
+        return True, data, dash.no_update
+    return True, dash.no_update, dash.no_update
+
+
+# 取り込み状況をサイドバーに表示する (処理中のものがなくなったら更新を止める)
+@app.callback(
+    Output("ingest-status", "children"),
+    Output("ingest-interval", "disabled"),
+    Input("ingest-interval", "n_intervals"),
+    prevent_initial_call=True,
+)
+def update_ingest_status(n_intervals):
+    state_labels = {
+        "queued": "待機中",
+        "running": "処理中",
+        "done": "完了",
+        "failed": "失敗",
+    }
+    statuses = recent_statuses()
+    children = []
+    for status in statuses:
+        text = f"{status['label']}: {state_labels[status['state']]}"
+        if status["state"] == "running":
+            text += f" ({status['message']})"
+        elif status["state"] == "failed":
+            text += f" ({status['error']})"
+        children.append(
+            html.Div(
+                [
+                    html.Small(text),
+                    dbc.Progress(
+                        value=round(status["progress"] * 100),
+                        color="danger" if status["state"] == "failed" else None,
+                        style={"height": "4px"},
+                    ),
+                ]
+            )
+        )
+    running = any(s["state"] in ("queued", "running") for s in statuses)
+    return children, not running
+
+
+@app.callback(
+    Output("catalog-version", "data"),
     [
         Input("file-reload-button", "n_clicks"),
         Input("delete-confirm-button", "n_clicks"),
     ],
     [State("uploaded-files-dropdown", "value")],
 )
-def update_dropdown(n1, n2, value):
+def update_catalog(n1, n2, value):
     ctx = dash.callback_context
 
     if not ctx.triggered:
@@ -243,23 +345,45 @@ def update_dropdown(n1, n2, value):
     if button_id == "file-reload-button":
         if n1 is None:
             raise PreventUpdate
-
-        for filepath in glob.glob("data/*/*"):
-            filename = os.path.basename(filepath)
-            uploaded_files_dict[filename] = filepath
-        uploaded_files = list(uploaded_files_dict.keys())
-        return [{"label": i, "value": i} for i in uploaded_files]
+        catalog.scan(config.DATA_DIR)  # 変更のあったフォルダだけを走査
+        return time.time()
 
     elif button_id == "delete-confirm-button":
-        if n2:
-            os.remove(uploaded_files_dict[value])  # ファイルを削除
-            del uploaded_files_dict[value]  # 辞書から削除
-            uploaded_files = list(uploaded_files_dict.keys())
-            return [{"label": i, "value": i} for i in uploaded_files]
+        if n2 and catalog.get(value):
+            os.remove(value)  # ファイルを削除
+            remove_sidecars(value)  # 付随データを削除
+            invalidate_path(value)  # キャッシュから削除
+            catalog.remove(value)  # カタログから削除
+            return time.time()
         else:
             raise dash.exceptions.PreventUpdate
 
 
+# ファイル一覧をカタログから検索し、1ページ分だけ表示する
+@app.callback(
+    Output("uploaded-files-dropdown", "options"),
+    Output("file-pagination", "max_value"),
+    Input("uploaded-files-dropdown", "search_value"),
+    Input("file-pagination", "active_page"),
+    Input("catalog-version", "data"),
+    State("uploaded-files-dropdown", "value"),
+)
+def update_dropdown(search_value, active_page, version, value):
+    rows, total = catalog.search(
+        search_value, active_page or 1, config.CATALOG_PAGE_SIZE
+    )
+    if not rows and total:
+        # 検索で件数が減った場合は先頭ページを表示する
+        rows, total = catalog.search(search_value, 1, config.CATALOG_PAGE_SIZE)
+    # 選択中のファイルは検索結果になくても選択肢に残す
+    selected = catalog.get(value)
+    if selected is not None and all(row["path"] != value for row in rows):
+        rows = [selected] + rows
+    options = [{"label": file_label(row), "value": row["path"]} for row in rows]
+    max_value = max(math.ceil(total / config.CATALOG_PAGE_SIZE), 1)
+    return options, max_value
+
+
 @app.callback(
     Output("file-select-button", "n_clicks"),
     Input("uploaded-files-dropdown", "value"),
@@ -275,28 +399,62 @@ def reset_button_on_new_file(value):
     State("uploaded-files-dropdown", "value"),
 )
 def load_new_file(n_clicks, value):
-    if n_clicks > 0:
-        data = uploaded_files_dict[value]
+    if n_clicks > 0 and catalog.get(value):
+        data = value
         return "ファイル変更", data
     else:
         raise dash.exceptions.PreventUpdate
 
 
+# ダウンロード用のURLを組み立てる (ファイルは専用のルートから直接送信する)
 @app.callback(
-    Output("download-csv", "data"),
-    Input("download-button", "n_clicks"),
-    State("uploaded-files-dropdown", "value"),
-    State("input-box", "value"),
-    prevent_initial_call=True,
+    Output("download-button", "href"),
+    Input("uploaded-files-dropdown", "value"),
+    Input("input-box", "value"),
+    Input("download-options", "value"),
+    Input("session-id", "data"),
 )
-def download_csv(n_clicks, value, input_value):
-    if n_clicks:
-        df = pd.read_csv(uploaded_files_dict[value])
-        if input_value:
-            filename = f"{input_value}.csv"
-        else:
-            filename = f"{value}"
-        return dcc.send_string(df.to_csv(index=False), filename)
+def update_download_href(value, input_value, options, session_id):
+    if not value:
+        return None
+    params = {"file": value}
+    if input_value:
+        params["name"] = input_value
+    if "gzip" in options:
+        params["gzip"] = "1"
+    if "edited" in options and session_id:
+        params["session"] = session_id
+    return f"/download?{urllib.parse.urlencode(params)}"
+
+
+def download_file():
+    args = flask.request.args
+    # カタログに登録されたファイルだけを送信する
+    row = catalog.get(args.get("file"))
+    if row is None:
+        flask.abort(404)
+    path = row["path"]
+    if args.get("name"):
+        filename = f"{args['name']}.csv"
+    else:
+        filename = row["name"]
+    compress = args.get("gzip") == "1"
+
+    # page3で加工中のデータはチャンクごとに手順を適用してCSVに変換する
+    session_id = args.get("session")
+    ws = page3.working_sets.get(session_id) if session_id else None
+    if ws is not None and ws.source == path and ws.plan.steps:
+        frames = (
+            page3.engine.to_pandas(chunk)
+            for chunk in ws.iter_chunks(config.DOWNLOAD_CHUNK_ROWS)
+        )
+        return csv_response(iter_csv(frames), filename, compress)
+    if compress:
+        return csv_response(iter_file(path), filename, compress)
+    return flask.send_file(path, as_attachment=True, download_name=filename)
+
+
+app.server.add_url_rule("/download", "download", auth.auth_wrapper(download_file))
 
 
 @app.callback(
@@ -313,7 +471,7 @@ def download_csv(n_clicks, value, input_value):
     ],
 )
 def toggle_modal(n1, n2, n3, is_open, value):
-    header_text = f"選択中のファイル：{value}"
+    header_text = f"選択中のファイル：{os.path.basename(value or '')}"
     if n1 or n2 or n3:
         return not is_open, header_text
     return is_open, header_text
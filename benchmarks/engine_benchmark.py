@@ -0,0 +1,86 @@
+# page3の加工処理をエンジンごとに計測する
+# 使い方: python -m benchmarks.engine_benchmark --rows 1000000 --cols 20
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import config
+from utils.engine import available_engines, get_engine
+from utils.impute import ChainedImputer
+from utils.plan import (
+    DropColumns,
+    DropMissingRows,
+    ReplaceColumns,
+    fit_fill_mean,
+    fit_fill_mode,
+    fit_normalize,
+    fit_standardize,
+)
+
+
+def make_frame(n_rows: int, n_cols: int, missing_rate: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(n_rows, n_cols))
+    values[rng.random(size=values.shape) < missing_rate] = np.nan
+    return pd.DataFrame(values, columns=[f"cont{i}" for i in range(n_cols)])
+
+
+# page3の多重代入法 (全行で推定) と同じ処理
+def impute(engine, df, cols):
+    values = engine.to_pandas(df[cols])
+    filled = ChainedImputer(
+        config.IMPUTE_MAX_ITER, config.IMPUTE_TOL, 1, sequential=True
+    ).fit_transform(values.to_numpy(dtype=float))
+    imputed = pd.DataFrame(filled, columns=cols, index=values.index)
+    return ReplaceColumns(engine.from_pandas(imputed))
+
+
+def run(engine_name: str, source: pd.DataFrame, repeat: int, impute_rows: int):
+    engine = get_engine(engine_name)
+    df = engine.from_pandas(source)
+    cols = list(source.columns)
+    # page3と同じく、統計量の推定と手順の適用をまとめて計測する
+    operations = {
+        "drop_columns": lambda: DropColumns(tuple(cols[:1])).apply(df),
+        "drop_missing": lambda: DropMissingRows(tuple(cols)).apply(df),
+        "fill_mean": lambda: fit_fill_mean(df[cols]).apply(df),
+        "fill_mode": lambda: fit_fill_mode(df[cols]).apply(df),
+        "normalize": lambda: fit_normalize(df[cols]).apply(df),
+        "standardize": lambda: fit_standardize(df[cols]).apply(df),
+        # 多重代入法はCPUで動くので行数を絞って計測する
+        "impute": lambda: impute(engine, df.iloc[:impute_rows], cols).apply(df),
+    }
+    results = {}
+    for name, operation in operations.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - start)
+        results[name] = min(timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--missing-rate", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--impute-rows", type=int, default=20_000)
+    parser.add_argument("--engines", nargs="*", default=available_engines())
+    args = parser.parse_args()
+
+    source = make_frame(args.rows, args.cols, args.missing_rate)
+    results = {
+        name: run(name, source, args.repeat, args.impute_rows) for name in args.engines
+    }
+    table = pd.DataFrame(results)
+    print(f"rows={args.rows} cols={args.cols} (best of {args.repeat}, seconds)")
+    print(table.to_string(float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+
+# 読み込み済みデータフレームを保持するキャッシュの上限 (バイト)
+DATASET_CACHE_MAX_BYTES = int(
+    os.environ.get("DATASET_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+)
+
+# ファイルごとのプロファイル(列情報・欠損数など)を保持するキャッシュの上限 (バイト)
+PROFILE_CACHE_MAX_BYTES = int(
+    os.environ.get("PROFILE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+
+# 表示用テーブルの絞り込み・並び替え結果(行番号)を保持するキャッシュの上限 (バイト)
+TABLE_ROWS_CACHE_MAX_BYTES = int(
+    os.environ.get("TABLE_ROWS_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+# page1・page2の図や表(コールバックの結果)を保持するキャッシュの上限 (バイト)
+RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get("RESULT_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+)
+
+# 複数のワーカー(プロセス・ノード)で共有する状態の保存先
+# 複数ノードで動かす場合は共有ファイルシステム上のフォルダを指定する
+STATE_DIR = os.environ.get("STATE_DIR", "/usr/src/data/.state")
+
+# page3で編集中のデータ(セッションごと)をメモリに保持する上限 (バイト)
+WORKING_SET_MAX_BYTES = int(
+    os.environ.get("WORKING_SET_MAX_BYTES", 4 * 1024 * 1024 * 1024)
+)
+# 一定時間操作のないセッションのデータはメモリから外す (秒)
+WORKING_SET_IDLE_SECONDS = int(os.environ.get("WORKING_SET_IDLE_SECONDS", 10 * 60))
+# 保存した編集中データを削除するまでの時間 (秒)
+WORKING_SET_EXPIRE_SECONDS = int(
+    os.environ.get("WORKING_SET_EXPIRE_SECONDS", 24 * 60 * 60)
+)
+WORKING_SET_DIR = os.environ.get(
+    "WORKING_SET_DIR", os.path.join(STATE_DIR, "working_sets")
+)
+
+# page3のデータ加工に使うエンジン ("pandas", "cudf", "auto": GPUがあればcudf)
+DATAFRAME_ENGINE = os.environ.get("DATAFRAME_ENGINE", "pandas")
+
+# 多重代入法 (大規模データ向け) の設定
+# 推定に使う行数 (これより多い行は無作為に抽出する)
+IMPUTE_SAMPLE_ROWS = int(os.environ.get("IMPUTE_SAMPLE_ROWS", 100_000))
+# 全行を補完する際の行数の単位
+IMPUTE_CHUNK_ROWS = int(os.environ.get("IMPUTE_CHUNK_ROWS", 100_000))
+# 反復回数の上限と収束の判定値 (補完値の変化が値の最大絶対値のこの割合未満で打ち切る)
+IMPUTE_MAX_ITER = int(os.environ.get("IMPUTE_MAX_ITER", 10))
+IMPUTE_TOL = float(os.environ.get("IMPUTE_TOL", 1e-3))
+# 列ごとの推定を並列に実行するスレッド数 (-1: CPUコア数)
+IMPUTE_N_JOBS = int(os.environ.get("IMPUTE_N_JOBS", -1))
+
+# ダウンロード時に加工後のデータをCSVへ変換する行数の単位
+DOWNLOAD_CHUNK_ROWS = int(os.environ.get("DOWNLOAD_CHUNK_ROWS", 100_000))
+
+# page3の加工結果の保存先
+SAVE_DIR = os.environ.get("SAVE_DIR", "/usr/src/data/save")
+# page3で保存した加工手順 (推定済みの統計量) の保存先
+PIPELINE_DIR = os.environ.get("PIPELINE_DIR", os.path.join(STATE_DIR, "pipelines"))
+# 保存時にCSVへ書き出す行数の単位
+SAVE_CHUNK_ROWS = int(os.environ.get("SAVE_CHUNK_ROWS", 100_000))
+# バックグラウンド処理(保存など)を実行するスレッド数
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# バックグラウンド処理の状態を共有するデータベース
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(STATE_DIR, "jobs.sqlite3"))
+# 1人(セッション)あたりに同時に実行するバックグラウンド処理の数 (超えた分は順番待ち)
+JOB_MAX_PER_USER = int(os.environ.get("JOB_MAX_PER_USER", 2))
+# バックグラウンド処理の記録がこの時間 (秒) 途絶えたら、ワーカーが停止したとみなして失敗にする
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 60))
+# バックグラウンド処理の結果 (JSONにできないもの) の保存先
+JOB_RESULT_DIR = os.environ.get(
+    "JOB_RESULT_DIR", os.path.join(STATE_DIR, "job_results")
+)
+
+# アップロード先のフォルダ
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/usr/src/data")
+# ファイル一覧に表示するCSVを探すフォルダ (この下の各フォルダを走査する)
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+# ファイル一覧(カタログ)のデータベース
+CATALOG_PATH = os.environ.get(
+    "CATALOG_PATH", os.path.join(DATA_DIR, ".catalog.sqlite3")
+)
+# ファイル選択のドロップダウンに1ページで表示する件数
+CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", 50))
+
+# page1の分布図(密度曲線)を計算する点数
+DENSITY_GRID_POINTS = int(os.environ.get("DENSITY_GRID_POINTS", 512))
+# 分布図の計算に使う行数の上限 (超える場合は無作為抽出する)
+DENSITY_SAMPLE_MAX = int(os.environ.get("DENSITY_SAMPLE_MAX", 1_000_000))
+# ヒートマップに相関係数の数値を表示する列数の上限
+CORR_ANNOTATE_MAX_COLUMNS = int(os.environ.get("CORR_ANNOTATE_MAX_COLUMNS", 20))
+# これより大きなファイルはpage1・page2で全体を読み込まず、1回の走査で集計した値を使う (バイト)
+LARGE_FILE_BYTES = int(os.environ.get("LARGE_FILE_BYTES", 512 * 1024 * 1024))
+# page2の外れ値の一覧に表示する行数の上限
+OUTLIER_ROWS_MAX = int(os.environ.get("OUTLIER_ROWS_MAX", 10_000))
+# 取り込み前の大きなファイルで先に表示する概算に使う行数
+PREVIEW_SAMPLE_ROWS = int(os.environ.get("PREVIEW_SAMPLE_ROWS", 100_000))
+# 概算用の行を読み出す箇所の数 (ファイル内の無作為な位置から連続した行を読む)
+PREVIEW_SAMPLE_BLOCKS = int(os.environ.get("PREVIEW_SAMPLE_BLOCKS", 1000))
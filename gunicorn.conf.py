@@ -0,0 +1,14 @@
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8))
+)
+# 1ワーカー内でも重い集計の間に他のリクエストを処理できるようスレッドを使う
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# 大きなファイルのダウンロードや集計に時間がかかるため長めにする
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+# sqliteの接続やスレッドプールをfork前に作らないよう、ワーカーごとにアプリを読み込む
+preload_app = False
+accesslog = "-"
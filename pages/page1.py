@@ -5,8 +5,18 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.figure_factory as ff
+import plotly.graph_objects as go
 from dash import Input, Output, State, callback, dcc, html
 
+import config
+from utils.cache import memoize_result, read_dataset
+from utils.counts import category_counts
+from utils.density import density_curves
+from utils.moments import correlation
+from utils.preview import preview_note, preview_source
+from utils.profile import columns_of_kind, load_profile
+from utils.streaming import is_large_file, sample_columns
+
 vars_cat: List[str] = []
 vars_cont: List[str] = []
 
@@ -37,6 +47,7 @@ contents = html.Div(
             ],
             className="bg-primary text-white font-italic topMenu ",
         ),
+        html.Small(id="page1-preview-note", className="text-muted"),
         dbc.Row(
             [
                 dbc.Col(
@@ -186,11 +197,16 @@ layout = html.Div(
     Output("bar-title", "children"),
     Input("setting-change-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
     State("my-cat-picker", "value"),
 )
-def update_bar(n_clicks, data, cat_pick):
-    df = pd.read_csv(data)
-    bar_df = df.groupby(["target", cat_pick]).count()["id"].reset_index()
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_bar(n_clicks, data, preview_ready, cat_pick):
+    # 取り込み時に集計した件数を使う (ファイル全体は読まない)
+    bar_df = pd.DataFrame(
+        category_counts(data, cat_pick) or [], columns=["target", cat_pick, "id"]
+    )
     bar_df["target"] = (
         bar_df["target"].astype(str).replace({"0": "target=0", "1": "target=1"})
     )
@@ -225,20 +241,38 @@ def update_bar(n_clicks, data, cat_pick):
     Output("dist-title", "children"),
     Input("setting-change-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
     State("my-cont-picker", "value"),
 )
-def update_dist(n_clicks, data, cont_pick):
-    df = pd.read_csv(data)
-    num0 = df[df["target"] == 0][cont_pick].values.tolist()
-    num1 = df[df["target"] == 1][cont_pick].values.tolist()
-
-    fig_dist = ff.create_distplot(
-        hist_data=[num0, num1],
-        group_labels=["target=0", "target=1"],
-        show_hist=False,
-        colors=["#bad6eb", "#2b7bba"],
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_dist(n_clicks, data, preview_ready, cont_pick):
+    if is_large_file(data):
+        # 大きなファイルは全体を読み込まず、抽出した行だけで密度を求める
+        df = sample_columns(
+            data, ["target", cont_pick], config.DENSITY_SAMPLE_MAX
+        ).to_pandas()
+    else:
+        df = read_dataset(data, ["target", cont_pick])
+    # 全ての点ではなく格子上の密度曲線だけを送る
+    grid, curves = density_curves(
+        [
+            df.loc[df["target"] == 0, cont_pick].to_numpy(),
+            df.loc[df["target"] == 1, cont_pick].to_numpy(),
+        ],
+        config.DENSITY_GRID_POINTS,
+        config.DENSITY_SAMPLE_MAX,
     )
 
+    fig_dist = go.Figure()
+    for name, color, curve in zip(
+        ["target=0", "target=1"], ["#bad6eb", "#2b7bba"], curves
+    ):
+        if curve is not None:
+            fig_dist.add_trace(
+                go.Scatter(x=grid, y=curve, mode="lines", name=name, marker_color=color)
+            )
+
     fig_dist.update_layout(
         autosize=True,
         margin=dict(t=20, b=20, l=40, r=20),
@@ -257,26 +291,34 @@ def update_dist(n_clicks, data, cont_pick):
     Output("corr-chart", "figure"),
     [
         Input("setting-change-button", "n_clicks"),
-        Input("file-select-button", "n_clicks"),
         Input("shared-selected-df", "data"),
+        Input("preview-ready", "data"),
     ],
     State("my-corr-picker", "value"),
 )
-def update_corr(n_clicks, file_n_clicks, data, corr_pick):
-    df = pd.read_csv(data)
-    df_corr = df[corr_pick].corr()
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_corr(n_clicks, data, preview_ready, corr_pick):
+    # ファイルごとに集計済みの値から、選んだ列の分だけ相関を求める
+    df_corr = correlation(data, corr_pick)
     x = list(df_corr.columns)
     y = list(df_corr.index)
     z = df_corr.values
 
-    fig_corr = ff.create_annotated_heatmap(
-        z,
-        x=x,
-        y=y,
-        annotation_text=np.around(z, decimals=2),
-        hoverinfo="z",
-        colorscale="Blues",
-    )
+    if len(x) <= config.CORR_ANNOTATE_MAX_COLUMNS:
+        fig_corr = ff.create_annotated_heatmap(
+            z,
+            x=x,
+            y=y,
+            annotation_text=np.around(z, decimals=2),
+            hoverinfo="z",
+            colorscale="Blues",
+        )
+    else:
+        # 列が多いときは数値を表示しない
+        fig_corr = go.Figure(
+            go.Heatmap(z=z, x=x, y=y, hoverinfo="x+y+z", colorscale="Blues")
+        )
 
     fig_corr.update_layout(
         autosize=True,
@@ -294,13 +336,24 @@ def update_corr(n_clicks, file_n_clicks, data, corr_pick):
     Output("my-corr-picker", "options"),
     [Input("shared-selected-df", "data")],
 )
+@preview_source
 def update_dropdown_options(data):
-    df = pd.read_csv(data)
-    vars_cat = [var for var in df.columns if var.startswith("cat")]
-    vars_cont = [var for var in df.columns if var.startswith("cont")]
+    profile = load_profile(data)
+    vars_cat = columns_of_kind(profile, "cat")
+    vars_cont = columns_of_kind(profile, "cont")
 
     options_cat = [{"label": x, "value": x} for x in vars_cat]
     options_cont = [{"label": x, "value": x} for x in vars_cont]
     options_corr = [{"label": x, "value": x} for x in vars_cont + ["target"]]
 
     return options_cat, options_cont, options_corr
+
+
+# 概算を表示しているかを表示するコールバック
+@callback(
+    Output("page1-preview-note", "children"),
+    Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
+)
+def update_preview_note(data, preview_ready):
+    return preview_note(data)
@@ -1,11 +1,21 @@
 from typing import List
 
 import dash_bootstrap_components as dbc
-import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
 from dash import callback, dash_table, dcc, html
 from dash.dependencies import Input, Output, State
 
+from utils import columnar
+from utils.aggregate import grouped_mode, scan_group_moments, scan_grouped_mode
+from utils.cache import file_fingerprint, memoize_result, read_dataset
+from utils.nullmask import load_null_masks
+from utils.outliers import find_outliers
+from utils.preview import preview_note, preview_source
+from utils.profile import column_names, load_profile
+from utils.streaming import group_stats, is_large_file
+from utils.table import file_page_records, page_records, query_file_rows, query_rows
+
 vars_cat: List[str] = []
 vars_cont: List[str] = []
 
@@ -36,6 +46,7 @@ contents = html.Div(
             className="bg-primary text-white font-italic topMenu ",
         ),
         html.Div(id="page2-selected-file", className="font-weight-bold"),
+        html.Small(id="page2-preview-note", className="text-muted"),
         dbc.Row(
             html.Div(
                 [
@@ -53,6 +64,14 @@ contents = html.Div(
                                 columns=[],
                                 data=[],
                                 virtualization=True,
+                                page_current=0,
+                                page_size=100,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="multi",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
                                 style_table={
                                     "overflowX": "auto",
                                     "overflowY": "auto",
@@ -105,6 +124,17 @@ contents = html.Div(
                                     html.Table(id="page2-defi-table"),
                                     style={"height": "15vh", "overflow": "scroll"},
                                 ),
+                                html.P(
+                                    id="page2-comissing-title",
+                                    className="font-weight-bold",
+                                    style={
+                                        "margin-top": "16px",
+                                        "margin-bottom": "4px",
+                                    },
+                                ),
+                                dcc.Graph(
+                                    id="page2-comissing-chart", className="bg-light"
+                                ),
                                 html.P(
                                     id="page2-outlier-count-title",
                                     className="font-weight-bold",
@@ -125,9 +155,24 @@ contents = html.Div(
                                         "margin-bottom": "4px",
                                     },
                                 ),
-                                html.P(
-                                    html.Table(id="page2-outlier-table"),
-                                    style={"height": "40vh", "overflow": "scroll"},
+                                dash_table.DataTable(
+                                    id="page2-outlier-table",
+                                    columns=[],
+                                    data=[],
+                                    virtualization=True,
+                                    page_current=0,
+                                    page_size=100,
+                                    page_action="custom",
+                                    sort_action="custom",
+                                    sort_mode="multi",
+                                    sort_by=[],
+                                    filter_action="custom",
+                                    filter_query="",
+                                    style_table={
+                                        "overflowX": "auto",
+                                        "overflowY": "auto",
+                                        "height": "40vh",
+                                    },
                                 ),
                             ],
                         ),
@@ -236,12 +281,13 @@ layout = html.Div(
     Output("page2-my-cat-picker", "options"),
     [Input("shared-selected-df", "data")],
 )
+@preview_source
 def update_page2_cat_picker_options(data):
     if data is None:
         return []
 
-    df = pd.read_csv(data)
-    options_cat = [{"label": col, "value": col} for col in df.columns]
+    columns = column_names(load_profile(data))
+    options_cat = [{"label": col, "value": col} for col in columns]
 
     return options_cat
 
@@ -251,13 +297,13 @@ def update_page2_cat_picker_options(data):
     Output("page2-my-cont-picker", "options"),
     [Input("shared-selected-df", "data")],
 )
+@preview_source
 def update_page2_cont_picker_options(data):
     if data is None:
         return []
 
-    df = pd.read_csv(data)
-
-    options_cont = [{"label": x, "value": x} for x in df.columns]
+    columns = column_names(load_profile(data))
+    options_cont = [{"label": x, "value": x} for x in columns]
 
     return options_cont
 
@@ -266,56 +312,67 @@ def update_page2_cont_picker_options(data):
 @callback(
     Output("page2-stats-table", "children"),
     Output("page2-stats-title", "children"),
-    Output("page2-selected-file", "children"),
     Input("page2-setting-change-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
     State("page2-my-cat-picker", "value"),
     State("page2-my-cont-picker", "value"),
 )
-def update_page2_stats_table(n_clicks, data, cat_pick, cont_pick):
-    df = pd.read_csv(data)
-    selected_file = data.split("/")
-    selected_file_name = f"選択中ファイル：{selected_file[-1]}"
-    if pd.api.types.is_numeric_dtype(df[cont_pick]):
-        # 数値型の場合
-        stats_df = df.groupby(cat_pick)[cont_pick].describe().reset_index()
-        stats_df_info = stats_df.loc[
-            :,
-            [
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_page2_stats_table(n_clicks, data, preview_ready, cat_pick, cont_pick):
+    large = is_large_file(data)
+    grouped = group_stats(data, cat_pick, cont_pick) if large else None
+    if grouped is not None:
+        # 大きなファイルは取り込み時に集計した値を使う (中央値は1回の走査では求めないため省く)
+        stats_df_info = pd.DataFrame(
+            {
+                cat_pick: grouped["levels"],
+                "件数": grouped["count"],
+                "平均": grouped["mean"],
+                "標準偏差": grouped["std"],
+            }
+        )
+    elif large:
+        # 取り込み時に集計していない組み合わせは、2列だけをバッチごとに読んで集計する
+        if cont_pick in columnar.numeric_columns(data):
+            stats_df_info = scan_group_moments(data, cat_pick, cont_pick)
+            stats_df_info.columns = [cat_pick, "件数", "平均", "標準偏差"]
+        else:
+            stats_df_info = scan_grouped_mode(data, cat_pick, cont_pick)
+            stats_df_info.columns = [
                 cat_pick,
-                "count",
-                "mean",
-                "std",
-                "50%",
-            ],
-        ]
-        stats_df_info.columns = [
-            cat_pick,
-            "件数",
-            "平均",
-            "標準偏差",
-            "中央値",
-        ]
+                "件数",
+                "最頻値",
+                "最頻値割合",
+                "ユニーク数",
+            ]
     else:
-        # 数値型でない場合
-        stats_df_info = (
-            df.groupby(cat_pick)[cont_pick]
-            .agg(
-                [
-                    "count",
-                    lambda x: x.mode().iloc[0],
-                    lambda x: (x.mode().count() / x.count()) * 100,
-                ]
+        df = read_dataset(data, [cat_pick, cont_pick])
+        if pd.api.types.is_numeric_dtype(df[cont_pick]):
+            # 数値型の場合 (表示する統計量だけを求める)
+            stats_df_info = (
+                df.groupby(cat_pick)[cont_pick]
+                .agg(["count", "mean", "std", "median"])
+                .reset_index()
             )
-            .reset_index()
-        )
-
-        stats_df_info.columns = [
-            cat_pick,
-            "件数",
-            "最頻値",
-            "最頻値割合",
-        ]
+            stats_df_info.columns = [
+                cat_pick,
+                "件数",
+                "平均",
+                "標準偏差",
+                "中央値",
+            ]
+        else:
+            # 数値型でない場合
+            stats_df_info = grouped_mode(df, cat_pick, cont_pick)
+            stats_df_info.columns = [
+                cat_pick,
+                "件数",
+                "最頻値",
+                "最頻値割合",
+                "ユニーク数",
+            ]
     table_columns = stats_df_info.columns
     table = dbc.Table.from_dataframe(
         stats_df_info,
@@ -331,26 +388,44 @@ def update_page2_stats_table(n_clicks, data, cat_pick, cont_pick):
     )
 
     stats_title = f"{cat_pick}ごとの{cont_pick}の基本統計量"
-    return table, stats_title, selected_file_name
+    return table, stats_title
+
+
+# 選択中のファイル名と、概算を表示しているかを表示するコールバック
+@callback(
+    Output("page2-selected-file", "children"),
+    Output("page2-matrix-selected-file", "children"),
+    Output("page2-preview-note", "children"),
+    Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
+)
+def update_page2_selected_file(data, preview_ready):
+    if data is None:
+        return "", "", ""
+    selected_file = data.split("/")
+    selected_file_name = f"選択中ファイル：{selected_file[-1]}"
+    return selected_file_name, selected_file[-1], preview_note(data)
 
 
 # データの欠損値を表示するコールバック
 @callback(
     Output("page2-defi-table", "children"),
     Output("page2-defi-title", "children"),
+    Output("page2-comissing-chart", "figure"),
+    Output("page2-comissing-title", "children"),
     Input("page2-setting-change-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
 )
-def update_page2_defi_table(n_clicks, data):
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_page2_defi_table(n_clicks, data, preview_ready):
     if data is None:
-        return "", ""
+        return "", "", {}, ""
 
-    df = pd.read_csv(data)
-
-    # 欠損値の数
-    defi_se = df.isnull().sum()
-    defi_df = pd.DataFrame(defi_se)
-    defi_df_T = defi_df.T
+    # 欠損値の数 (ファイルごとに1回だけ作る欠損位置のビット列から数える)
+    masks = load_null_masks(data)
+    defi_df_T = pd.DataFrame([masks.null_counts()])
     defi_df_columns = defi_df_T.columns
     table_missing = dbc.Table.from_dataframe(
         defi_df_T,
@@ -366,37 +441,45 @@ def update_page2_defi_table(n_clicks, data):
     )
     stats_title = "項目ごとの欠損値の数"
 
-    return table_missing, stats_title
+    # 2つの列が同時に欠損している行数 (欠損のある列のみ)
+    co_missing = masks.co_missing()
+    fig_comissing = go.Figure(
+        go.Heatmap(
+            z=co_missing.values,
+            x=list(co_missing.columns),
+            y=list(co_missing.index),
+            hoverinfo="x+y+z",
+            colorscale="Blues",
+        )
+    )
+    fig_comissing.update_layout(
+        autosize=True,
+        margin=dict(l=40, r=20, t=20, b=20),
+        paper_bgcolor="rgba(0,0,0,0)",
+    )
+    comissing_title = "同時に欠損している行数"
+
+    return table_missing, stats_title, fig_comissing, comissing_title
 
 
-# 外れ値を表示するコールバック
+# 外れ値の数を表示するコールバック
 @callback(
     Output("page2-outlier-count-table", "children"),
-    Output("page2-outlier-table", "children"),
     Output("page2-outlier-count-title", "children"),
     Output("page2-outlier-title", "children"),
     Input("page2-setting-change-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
 )
-def update_page2_outlier_table(n_clicks, data):
+@preview_source
+@memoize_result("n_clicks", "preview_ready")
+def update_page2_outlier_table(n_clicks, data, preview_ready):
     if data is None:
-        return "", ""
-
-    df = pd.read_csv(data)
+        return "", "", ""
 
-    # 外れ値の数 (IQR法を使用)
-    numeric_columns = df.select_dtypes(include=np.number).columns
-    q1 = df[numeric_columns].quantile(0.25)
-    q3 = df[numeric_columns].quantile(0.75)
-    iqr = q3 - q1
-
-    # 外れ値の具体的な値
-    outliers = (df[numeric_columns] < (q1 - 1.5 * iqr)) | (
-        df[numeric_columns] > (q3 + 1.5 * iqr)
-    )
-    # 外れ値カウント
-    outliers_count_se = df[outliers].count()
-    outliers_count_df = pd.DataFrame(outliers_count_se).T
+    # 外れ値の数 (IQR法を使用、一覧と同じ1回の走査で数える)
+    outliers_df = find_outliers(data)
+    outliers_count_df = pd.DataFrame([outliers_df.attrs["counts"]])
     outliers_count_df_columns = outliers_count_df.columns
     table_outliers_count = dbc.Table.from_dataframe(
         outliers_count_df,
@@ -410,40 +493,70 @@ def update_page2_outlier_table(n_clicks, data):
             "whiteSpace": "nowrap",
         },
     )
-    # 具体的な外れ値
-    outliers_df = df[outliers].dropna(how="all")
-    table_outliers = dbc.Table.from_dataframe(
-        outliers_df,  # Display only the first few rows of outliers for brevity
-        striped=True,
-        bordered=True,
-        hover=True,
-        style={
-            "writingMode": "horizontal-rl",
-            "textOrientation": "mixed",
-            "whiteSpace": "nowrap",
-        },
-    )
     outliers_count_title = "外れ値の数"
     outliers_table_title = "外れ値"
+    if outliers_df.attrs["total"] > len(outliers_df):
+        outliers_table_title += (
+            f" (全{outliers_df.attrs['total']}行のうち先頭{len(outliers_df)}行)"
+        )
 
     return (
         table_outliers_count,
-        table_outliers,
         outliers_count_title,
         outliers_table_title,
     )
 
 
+# 外れ値を含む行を表示するコールバック
+# 絞り込み・並び替え・ページ分割はサーバー側で行い、表示中のページだけを返す
+@callback(
+    Output("page2-outlier-table", "columns"),
+    Output("page2-outlier-table", "data"),
+    Output("page2-outlier-table", "page_count"),
+    Input("shared-selected-df", "data"),
+    Input("page2-outlier-table", "page_current"),
+    Input("page2-outlier-table", "page_size"),
+    Input("page2-outlier-table", "sort_by"),
+    Input("page2-outlier-table", "filter_query"),
+    Input("preview-ready", "data"),
+)
+@preview_source
+def update_outlier_rows(
+    data, page_current, page_size, sort_by, filter_query, preview_ready
+):
+    if data is None:
+        return [], [], 1
+    df = find_outliers(data)
+    columns = [{"name": i, "id": i} for i in df.columns]
+    rows = query_rows(df, ("outliers",) + file_fingerprint(data), sort_by, filter_query)
+    records, page_count = page_records(df, rows, page_current, page_size)
+    return columns, records, page_count
+
+
 # 入力データを表示するコールバック
+# 絞り込み・並び替え・ページ分割はサーバー側で行い、表示中のページだけを返す
+# 取り込み前の大きなファイルは抽出した行 (概算用のCSV) を表示する
 @callback(
-    Output("page2-matrix-selected-file", "children"),
     Output("table2", "columns"),
     Output("table2", "data"),
+    Output("table2", "page_count"),
     Input("shared-selected-df", "data"),
+    Input("table2", "page_current"),
+    Input("table2", "page_size"),
+    Input("table2", "sort_by"),
+    Input("table2", "filter_query"),
+    Input("preview-ready", "data"),
 )
-def update_table(data):
-    df = pd.read_csv(data, low_memory=False)
-    selectedfile = data.split("/")
+@preview_source
+def update_table(data, page_current, page_size, sort_by, filter_query, preview_ready):
+    if is_large_file(data):
+        # 大きなファイルは列指向のコピーから表示中のページの行だけを読む
+        columns = [{"name": i, "id": i} for i in columnar.column_names(data)]
+        rows = query_file_rows(data, file_fingerprint(data), sort_by, filter_query)
+        records, page_count = file_page_records(data, rows, page_current, page_size)
+        return columns, records, page_count
+    df = read_dataset(data)
     columns = [{"name": i, "id": j} for i, j in zip(df, df.columns)]
-    data = df.to_dict("records")
-    return selectedfile[-1], columns, data
+    rows = query_rows(df, file_fingerprint(data), sort_by, filter_query)
+    records, page_count = page_records(df, rows, page_current, page_size)
+    return columns, records, page_count
@@ -1,9 +1,45 @@
-import cudf
+import os
+import time
+
 import dash
 import dash_bootstrap_components as dbc
 from dash import Input, Output, State, callback, dash_table, dcc, html
-from sklearn.experimental import enable_iterative_imputer  # noqa: F401
-from sklearn.impute import IterativeImputer
+from dash.exceptions import PreventUpdate
+
+import config
+from utils.cache import read_dataset
+from utils.catalog import catalog, file_label
+from utils.engine import get_engine
+from utils.impute import impute_working_set, impute_working_set_sampled
+from utils.jobs import jobs
+from utils.pipeline import apply_pipeline, list_pipelines, save_pipeline
+from utils.plan import (
+    DropColumns,
+    DropMissingRows,
+    WorkingSet,
+    fit_fill_mean,
+    fit_fill_mode,
+    fit_normalize,
+    fit_standardize,
+    load_working_set,
+)
+from utils.preview import is_approximate, is_sample_path, preview_note, resolve
+from utils.save import save_working_set
+from utils.session_store import WorkingSetStore
+
+# データ加工に使うエンジン (既定はpandas、GPUがあればcudfも選択可)
+engine = get_engine()
+
+# セッションごとの編集中データ
+working_sets = WorkingSetStore(
+    config.WORKING_SET_MAX_BYTES,
+    config.WORKING_SET_DIR,
+    lambda header, line: load_working_set(
+        header, line, lambda source: engine.from_pandas(read_dataset(source))
+    ),
+    config.WORKING_SET_IDLE_SECONDS,
+    config.WORKING_SET_EXPIRE_SECONDS,
+)
 
 sidebarToggleBtn = dbc.Button(
     children=[html.I(className="fas fa-bars", style={"color": "#c2c7d0"})],
@@ -39,6 +75,7 @@ contents = html.Div(
                         id="selected-file-title",
                         className="font-weight-bold",
                     ),
+                    html.Small(id="page3-preview-note", className="text-muted"),
                     dcc.Loading(
                         id="loading",
                         type="circle",
@@ -89,7 +126,6 @@ settings = html.Div(
             [
                 html.Div(
                     [
-                        html.Div(id="store-data", style={"display": "none"}),
                         html.P(
                             "列の削除",
                             style={
@@ -132,6 +168,10 @@ settings = html.Div(
                                 {"label": "平均値代入法", "value": "mean"},
                                 {"label": "最頻値代入法", "value": "mode"},
                                 {"label": "多重代入法", "value": "imputer"},
+                                {
+                                    "label": "多重代入法 (大規模データ向け)",
+                                    "value": "imputer_sampled",
+                                },
                             ],
                             className="setting_dropdown",
                             placeholder="手法の選択",
@@ -143,6 +183,27 @@ settings = html.Div(
                             className=" text-white setting_buttom",
                             color="secondary",
                         ),
+                        dcc.Store(id="impute-job-id"),
+                        dcc.Store(id="page3-refresh"),
+                        dcc.Interval(
+                            id="impute-progress-interval",
+                            interval=1000,
+                            disabled=True,
+                        ),
+                        dbc.Progress(
+                            id="impute-progress",
+                            value=0,
+                            style={"margin-top": "8px"},
+                        ),
+                        dbc.Button(
+                            id="impute-cancel-button",
+                            n_clicks=0,
+                            children="取り消し",
+                            className=" text-white setting_buttom",
+                            color="secondary",
+                            disabled=True,
+                        ),
+                        html.Div(id="impute-status"),
                         html.P(
                             "スケーリング",
                             style={
@@ -173,6 +234,34 @@ settings = html.Div(
                             className=" text-white setting_buttom",
                             color="secondary",
                         ),
+                        html.P(
+                            "履歴",
+                            style={
+                                "margin-top": "8px",
+                                "margin-bottom": "4px",
+                            },
+                            className="font-weight-bold",
+                        ),
+                        dbc.ButtonGroup(
+                            [
+                                dbc.Button(
+                                    id="undo-button",
+                                    n_clicks=0,
+                                    children="元に戻す",
+                                    className=" text-white setting_buttom",
+                                    color="secondary",
+                                    disabled=True,
+                                ),
+                                dbc.Button(
+                                    id="redo-button",
+                                    n_clicks=0,
+                                    children="やり直し",
+                                    className=" text-white setting_buttom",
+                                    color="secondary",
+                                    disabled=True,
+                                ),
+                            ]
+                        ),
                         html.Hr(),
                         dbc.Input(
                             id="rename_file",
@@ -180,6 +269,14 @@ settings = html.Div(
                             placeholder="保存ファイルの名前",
                             className="setting_buttom",
                         ),
+                        dbc.Checklist(
+                            id="save-options",
+                            options=[
+                                {"label": "Parquetも出力", "value": "parquet"},
+                            ],
+                            value=[],
+                            switch=True,
+                        ),
                         dbc.Button(
                             id="save-button",
                             n_clicks=0,
@@ -187,6 +284,78 @@ settings = html.Div(
                             className=" text-white setting_buttom",
                             color="secondary",
                         ),
+                        dcc.Store(id="save-job-id"),
+                        dcc.Interval(
+                            id="save-progress-interval",
+                            interval=1000,
+                            disabled=True,
+                        ),
+                        dbc.Progress(
+                            id="save-progress",
+                            value=0,
+                            style={"margin-top": "8px"},
+                        ),
+                        dbc.Button(
+                            id="save-cancel-button",
+                            n_clicks=0,
+                            children="取り消し",
+                            className=" text-white setting_buttom",
+                            color="secondary",
+                            disabled=True,
+                        ),
+                        html.Div(id="save-status"),
+                        html.Hr(),
+                        html.P(
+                            "加工手順の保存・適用",
+                            style={
+                                "margin-top": "8px",
+                                "margin-bottom": "4px",
+                            },
+                            className="font-weight-bold",
+                        ),
+                        dbc.Input(
+                            id="pipeline-name",
+                            type="text",
+                            placeholder="手順の名前",
+                            className="setting_buttom",
+                        ),
+                        dbc.Button(
+                            id="pipeline-save-button",
+                            n_clicks=0,
+                            children="手順を保存",
+                            className=" text-white setting_buttom",
+                            color="secondary",
+                        ),
+                        html.Div(id="pipeline-save-status"),
+                        dcc.Dropdown(
+                            id="pipeline-dropdown",
+                            className="setting_dropdown",
+                            placeholder="保存した手順",
+                        ),
+                        dcc.Dropdown(
+                            id="pipeline-target-dropdown",
+                            className="setting_dropdown",
+                            placeholder="適用するファイル",
+                        ),
+                        dbc.Button(
+                            id="pipeline-apply-button",
+                            n_clicks=0,
+                            children="適用して保存",
+                            className=" text-white setting_buttom",
+                            color="secondary",
+                        ),
+                        dcc.Store(id="pipeline-job-id"),
+                        dcc.Interval(
+                            id="pipeline-progress-interval",
+                            interval=1000,
+                            disabled=True,
+                        ),
+                        dbc.Progress(
+                            id="pipeline-progress",
+                            value=0,
+                            style={"margin-top": "8px"},
+                        ),
+                        html.Div(id="pipeline-status"),
                     ],
                     className="setting d-grid",
                 ),
@@ -225,183 +394,407 @@ layout = html.Div(
     Output("delete-col-dropdown", "options"),
     Output("missing-value-col-dropdown", "options"),
     Output("scaling-col-dropdown", "options"),
+    Output("undo-button", "disabled"),
+    Output("redo-button", "disabled"),
+    Output("impute-job-id", "data"),
+    Output("impute-progress-interval", "disabled"),
     Input("delete-col-button", "n_clicks"),
     Input("delete-missing-value-button", "n_clicks"),
     Input("scale-button", "n_clicks"),
+    Input("undo-button", "n_clicks"),
+    Input("redo-button", "n_clicks"),
     Input("shared-selected-df", "data"),
+    Input("page3-refresh", "data"),
     Input("page3-table", "page_current"),
     Input("page3-table", "page_size"),
+    Input("preview-ready", "data"),
     State("delete-col-dropdown", "value"),
     State("missing-value-col-dropdown", "value"),
     State("missing-value-dropdown", "value"),
     State("scaling-col-dropdown", "value"),
     State("scaling-dropdown", "value"),
+    State("session-id", "data"),
 )
 def update_table(
     n,
     m,
     s,
+    u,
+    r,
     data,
+    refresh,
     page_current,
     page_size,
+    preview_ready,
     cols,
     missing_value_cols,
     missing_value_method,
     scaling_cols,
     scaling_method,
+    session_id,
 ):
-    global aaa
     ctx = dash.callback_context
     if not ctx.triggered:
         trigger_id = "No clicks yet"
     else:
         trigger_id = ctx.triggered[0]["prop_id"].split(".")[0]
+    impute_job_id = dash.no_update
     # 選択ファイルの読み込み
-    if trigger_id == "shared-selected-df":
-        df = cudf.read_csv(data)
-        selectedfile = data.split("/")
-        columns = [
-            {"name": i, "id": j, "editable": True, "renamable": True}
-            for i, j in zip(df, df.columns)
-        ]
-        col_options = [{"label": i, "value": i} for i in df.columns]
-        aaa = df
-        display_data = df.iloc[
-            page_current * page_size : (page_current + 1) * page_size  # NOQA
-        ].to_dict("records")
-        return (
-            selectedfile[-1],
-            display_data,
-            columns,
-            col_options,
-            col_options,
-            col_options,
-        )
+    if trigger_id in ("shared-selected-df", "preview-ready"):
+        ws = load_selected(trigger_id, data, preview_ready, session_id)
     # 列削除
     elif trigger_id == "delete-col-button" and n > 0:
-        df = cudf.DataFrame(aaa).drop(columns=cols)
-        selectedfile = data.split("/")
-        columns = [
-            {"name": i, "id": j, "editable": True, "renamable": True}
-            for i, j in zip(df, df.columns)
-        ]
-        col_options = [{"label": i, "value": i} for i in df.columns]
-        data = df.iloc[
-            page_current * page_size : (page_current + 1) * page_size  # NOQA
-        ].to_dict("records")
-        aaa = df
-        return (
-            selectedfile[-1],
-            data,
-            columns,
-            col_options,
-            col_options,
-            col_options,
+        ws = current_working_set(session_id, editable=True).then(
+            DropColumns(tuple(cols or []))
         )
     # 欠損値処理
     elif trigger_id == "delete-missing-value-button" and m > 0:
-        df = cudf.DataFrame(aaa)
-        print(df)
-        if not missing_value_cols:
-            missing_value_cols = df.columns
-        if missing_value_method == "listwise":
-            df = df.dropna(subset=missing_value_cols)
-        elif missing_value_method == "mean":
-            df[missing_value_cols] = df[missing_value_cols].astype(float)
-            df[missing_value_cols] = df[missing_value_cols].fillna(
-                df[missing_value_cols].mean()
-            )
-
-        elif missing_value_method == "mode":
-            df[missing_value_cols] = df[missing_value_cols].fillna(
-                df[missing_value_cols].mode().iloc[0]
-            )
-        elif missing_value_method == "imputer":
-            imputer = IterativeImputer(max_iter=10, random_state=0)
-            df[missing_value_cols] = cudf.DataFrame(
-                imputer.fit_transform(df[missing_value_cols]),
-                columns=df[missing_value_cols].columns,
-            )
-        selectedfile = data.split("/")
-        columns = [
-            {"name": i, "id": j, "editable": True, "renamable": True}
-            for i, j in zip(df, df.columns)
-        ]
-        col_options = [{"label": i, "value": i} for i in df.columns]
-        data = df.iloc[
-            page_current * page_size : (page_current + 1) * page_size  # NOQA
-        ].to_dict("records")
-        aaa = df
-        return (
-            selectedfile[-1],
-            data,
-            columns,
-            col_options,
-            col_options,
-            col_options,
+        ws, impute_job_id = handle_missing_values(
+            session_id, missing_value_cols, missing_value_method
         )
     # スケーリング処理
     elif trigger_id == "scale-button" and s > 0:
-        df = cudf.DataFrame(aaa)
-        if not scaling_cols:
-            scaling_cols = df.columns
-        if scaling_method == "normalize":
-            df[scaling_cols] = df[scaling_cols].astype(float)
-            df[scaling_cols] = (df[scaling_cols] - df[scaling_cols].min()) / (
-                df[scaling_cols].max() - df[scaling_cols].min()
-            )
-        elif scaling_method == "standardize":
-            df[scaling_cols] = df[scaling_cols].astype(float)
-            df[scaling_cols] = (df[scaling_cols] - df[scaling_cols].mean()) / df[
-                scaling_cols
-            ].std()
-        selectedfile = data.split("/")
-        columns = [
-            {"name": i, "id": j, "editable": True, "renamable": True}
-            for i, j in zip(df, df.columns)
-        ]
-        col_options = [{"label": i, "value": i} for i in df.columns]
-        data = df.iloc[
-            page_current * page_size : (page_current + 1) * page_size  # NOQA
-        ].to_dict("records")
-        aaa = df.to_dict("records")
-        return (
-            selectedfile[-1],
-            data,
-            columns,
-            col_options,
-            col_options,
-            col_options,
-        )
+        ws = apply_scaling(session_id, scaling_cols, scaling_method)
+    # 元に戻す・やり直し (履歴上の位置を移動するだけ)
+    elif trigger_id == "undo-button" and u > 0:
+        ws = current_working_set(session_id).undo()
+    elif trigger_id == "redo-button" and r > 0:
+        ws = current_working_set(session_id).redo()
+    # バックグラウンド処理の結果を反映した後の再表示
+    elif trigger_id == "page3-refresh":
+        ws = current_working_set(session_id)
+    # ページ切り替え (表示中のページだけを計算する)
     else:
-        df = cudf.DataFrame(aaa)
-        display_data = df.iloc[
-            page_current * page_size : (page_current + 1) * page_size  # NOQA
-        ].to_dict("records")
-        return (
-            dash.no_update,
-            display_data,
-            dash.no_update,
-            dash.no_update,
-            dash.no_update,
+        ws = current_working_set(session_id)
+        return (dash.no_update, page_records(ws, page_current, page_size)) + (
             dash.no_update,
+        ) * 8
+
+    working_sets.put(session_id, ws)
+    selectedfile = data.split("/")
+    columns = [
+        {"name": i, "id": i, "editable": True, "renamable": True} for i in ws.columns()
+    ]
+    col_options = [{"label": i, "value": i} for i in ws.columns()]
+    return (
+        selectedfile[-1],
+        page_records(ws, page_current, page_size),
+        columns,
+        col_options,
+        col_options,
+        col_options,
+        not ws.can_undo(),
+        not ws.can_redo(),
+        impute_job_id,
+        impute_job_id is dash.no_update,
+    )
+
+
+def page_records(ws, page_current, page_size):
+    return engine.to_pandas(ws.page(page_current, page_size)).to_dict("records")
+
+
+# 選択ファイルを読み込む (取り込み前の大きなファイルは抽出した行を表示する)
+# 取り込みが終わったら、抽出した行を表示している場合だけファイル全体を読み込み直す
+def load_selected(trigger_id, data, preview_ready, session_id):
+    if trigger_id == "preview-ready" and not (
+        preview_ready == data
+        and is_sample_path(getattr(working_sets.get(session_id), "source", None))
+    ):
+        raise PreventUpdate
+    source = resolve(data)[0]
+    # 読み込み済みのデータを共有する (加工処理は元のフレームを変更しない)
+    return WorkingSet(source, engine.from_pandas(read_dataset(source)))
+
+
+# 欠損値処理 (統計量だけを計算して手順に記録する)
+# 多重代入法は時間がかかるのでバックグラウンドで実行し、終わったら手順に追加する
+def handle_missing_values(session_id, cols, method):
+    ws = current_working_set(session_id, editable=True)
+    if not cols:
+        cols = ws.columns()
+    if method == "listwise":
+        ws = ws.then(DropMissingRows(tuple(cols)))
+    elif method == "mean":
+        ws = ws.then(fit_fill_mean(ws.materialize(cols)))
+    elif method == "mode":
+        ws = ws.then(fit_fill_mode(ws.materialize(cols)))
+    elif method in ("imputer", "imputer_sampled"):
+        job_id = jobs.submit(
+            (
+                impute_working_set_sampled
+                if method == "imputer_sampled"
+                else impute_working_set
+            ),
+            ws,
+            engine,
+            list(cols),
+            label="多重代入法",
+            owner=session_id,
+            kind="impute",
         )
+        return ws, job_id
+    return ws, dash.no_update
 
 
+def apply_scaling(session_id, cols, method):
+    ws = current_working_set(session_id, editable=True)
+    if not cols:
+        cols = ws.columns()
+    if method == "normalize":
+        ws = ws.then(fit_normalize(ws.materialize(cols)))
+    elif method == "standardize":
+        ws = ws.then(fit_standardize(ws.materialize(cols)))
+    return ws
+
+
+# editable: 加工・保存に使う (抽出した行だけの概算のデータは加工しない)
+def current_working_set(session_id, editable=False):
+    ws = working_sets.get(session_id)
+    if ws is None or (editable and is_sample_path(ws.source)):
+        raise PreventUpdate
+    return ws
+
+
+# 取り込み前の大きなファイルは概算であることを表示し、加工・保存できないようにする
 @callback(
-    Output("store-data", "children"),
+    Output("page3-preview-note", "children"),
+    Output("delete-col-button", "disabled"),
+    Output("delete-missing-value-button", "disabled"),
+    Output("scale-button", "disabled"),
+    Output("save-button", "disabled"),
+    Output("pipeline-save-button", "disabled"),
+    Input("shared-selected-df", "data"),
+    Input("preview-ready", "data"),
+)
+def update_preview_note(data, preview_ready):
+    approximate = is_approximate(data)
+    note = preview_note(data)
+    if approximate:
+        note += "加工・保存は全体の読み込みが終わってから行えます。"
+    return (note,) + (approximate,) * 5
+
+
+# 保存はバックグラウンドで実行し、進捗を定期的に表示する
+@callback(
+    Output("save-job-id", "data"),
+    Output("save-progress-interval", "disabled"),
     [Input("save-button", "n_clicks")],
     [
         State("rename_file", "value"),
         State("uploaded-files-dropdown", "value"),
+        State("save-options", "value"),
+        State("session-id", "data"),
     ],
+    prevent_initial_call=True,
 )
-def save_table(n_clicks, file_rename_value, file_current_name):
+def save_table(n_clicks, file_rename_value, file_current_name, options, session_id):
     if n_clicks > 0:
-        df = cudf.DataFrame(aaa, dtype=object)
+        # 保存時に全ての加工手順を実行する (編集中の版をそのまま渡す)
+        ws = current_working_set(session_id, editable=True)
         if file_rename_value:
             filename = f"{file_rename_value}.csv"
         else:
-            filename = f"{file_current_name}.csv"
-        filepath = f"/usr/src/data/save/{filename}"
-        df.to_csv(filepath, index=False)
+            filename = f"{os.path.basename(file_current_name)}.csv"
+        filepath = os.path.join(config.SAVE_DIR, os.path.basename(filename))
+        job_id = jobs.submit(
+            save_working_set,
+            ws,
+            engine,
+            filepath,
+            config.SAVE_CHUNK_ROWS,
+            "parquet" in options,
+            label=f"保存: {os.path.basename(filename)}",
+            owner=session_id,
+            kind="save",
+        )
+        return job_id, False
+    raise PreventUpdate
+
+
+@callback(
+    Output("save-progress", "value"),
+    Output("save-progress", "label"),
+    Output("save-status", "children"),
+    Output("save-progress-interval", "disabled", allow_duplicate=True),
+    Output("save-cancel-button", "disabled"),
+    Input("save-progress-interval", "n_intervals"),
+    State("save-job-id", "data"),
+    prevent_initial_call=True,
+)
+def update_save_progress(n_intervals, job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return 0, "", "", True, True
+    percent = round(status["progress"] * 100)
+    if status["state"] == "failed":
+        return percent, "", f"保存に失敗しました ({status['error']})", True, True
+    if status["state"] == "cancelled":
+        return percent, "", "保存を取り消しました", True, True
+    if status["state"] == "done":
+        return 100, "100%", "保存しました", True, True
+    return percent, f"{percent}%", f"保存中... {status['message']}", False, False
+
+
+@callback(
+    Output("save-status", "children", allow_duplicate=True),
+    Input("save-cancel-button", "n_clicks"),
+    State("save-job-id", "data"),
+    prevent_initial_call=True,
+)
+def cancel_save(n_clicks, job_id):
+    if not n_clicks or not job_id:
+        raise PreventUpdate
+    jobs.cancel(job_id)
+    return "取り消しています..."
+
+
+# 多重代入法の進捗を表示し、終わったら結果を編集中のデータに追加する
+@callback(
+    Output("impute-progress", "value"),
+    Output("impute-progress", "label"),
+    Output("impute-status", "children"),
+    Output("impute-progress-interval", "disabled", allow_duplicate=True),
+    Output("impute-cancel-button", "disabled"),
+    Output("page3-refresh", "data"),
+    Input("impute-progress-interval", "n_intervals"),
+    State("impute-job-id", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def update_impute_progress(n_intervals, job_id, session_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return 0, "", "", True, True, dash.no_update
+    percent = round(status["progress"] * 100)
+    if status["state"] == "failed":
+        message = f"多重代入法に失敗しました ({status['error']})"
+        return percent, "", message, True, True, dash.no_update
+    if status["state"] == "cancelled":
+        return percent, "", "多重代入法を取り消しました", True, True, dash.no_update
+    if status["state"] == "done":
+        # 結果は一度だけ受け取れる (他のタブ・ワーカーが受け取った場合は何もしない)
+        result = jobs.fetch(job_id)
+        if result is None:
+            return 100, "100%", "", True, True, dash.no_update
+        # 実行中に加工・元に戻すなどで編集中のデータが変わった場合は適用しない
+        ws = working_sets.get(session_id)
+        if ws is None or ws.version != result["version"]:
+            message = "実行中にデータが変更されたため結果を破棄しました (もう一度実行してください)"
+            return 100, "100%", message, True, True, dash.no_update
+        working_sets.put(session_id, ws.then(result["step"]))
+        return 100, "100%", "多重代入法を適用しました", True, True, time.time()
+    message = status["message"] if status["state"] == "running" else "順番待ち"
+    return percent, f"{percent}%", f"多重代入法... {message}", False, False, dash.no_update
+
+
+@callback(
+    Output("impute-status", "children", allow_duplicate=True),
+    Input("impute-cancel-button", "n_clicks"),
+    State("impute-job-id", "data"),
+    prevent_initial_call=True,
+)
+def cancel_impute(n_clicks, job_id):
+    if not n_clicks or not job_id:
+        raise PreventUpdate
+    jobs.cancel(job_id)
+    return "取り消しています..."
+
+
+# 加工手順(推定済みの統計量)に名前を付けて保存する
+@callback(
+    Output("pipeline-save-status", "children"),
+    Input("pipeline-save-button", "n_clicks"),
+    State("pipeline-name", "value"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def save_pipeline_steps(n_clicks, name, session_id):
+    if not n_clicks:
+        raise PreventUpdate
+    ws = current_working_set(session_id, editable=True)
+    try:
+        save_pipeline(name, ws)
+    except ValueError as e:
+        return str(e)
+    return f"手順「{name.strip()}」を保存しました"
+
+
+@callback(
+    Output("pipeline-dropdown", "options"),
+    Input("pipeline-save-status", "children"),
+)
+def update_pipeline_options(save_status):
+    return [{"label": p["name"], "value": p["name"]} for p in list_pipelines()]
+
+
+# 適用先のファイルをカタログから検索する
+@callback(
+    Output("pipeline-target-dropdown", "options"),
+    Input("pipeline-target-dropdown", "search_value"),
+    State("pipeline-target-dropdown", "value"),
+)
+def update_pipeline_targets(search_value, value):
+    rows, _ = catalog.search(search_value, 1, config.CATALOG_PAGE_SIZE)
+    selected = catalog.get(value)
+    if selected is not None and all(row["path"] != value for row in rows):
+        rows = [selected] + rows
+    return [{"label": file_label(row), "value": row["path"]} for row in rows]
+
+
+# 保存した手順を別のファイルに一定行数ずつ適用し、結果を保存先に書き出す
+@callback(
+    Output("pipeline-job-id", "data"),
+    Output("pipeline-progress-interval", "disabled"),
+    Input("pipeline-apply-button", "n_clicks"),
+    State("pipeline-dropdown", "value"),
+    State("pipeline-target-dropdown", "value"),
+    State("save-options", "value"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def run_pipeline(n_clicks, name, target, options, session_id):
+    row = catalog.get(target)
+    if not n_clicks or not name or row is None:
+        raise PreventUpdate
+    stem = os.path.splitext(row["name"])[0]
+    filepath = os.path.join(config.SAVE_DIR, f"{stem}_{name}.csv")
+    job_id = jobs.submit(
+        apply_pipeline,
+        name,
+        row["path"],
+        filepath,
+        config.SAVE_CHUNK_ROWS,
+        "parquet" in options,
+        label=f"手順の適用: {name} → {row['name']}",
+        owner=session_id,
+        kind="pipeline",
+    )
+    return job_id, False
+
+
+@callback(
+    Output("pipeline-progress", "value"),
+    Output("pipeline-progress", "label"),
+    Output("pipeline-status", "children"),
+    Output("pipeline-progress-interval", "disabled", allow_duplicate=True),
+    Input("pipeline-progress-interval", "n_intervals"),
+    State("pipeline-job-id", "data"),
+    prevent_initial_call=True,
+)
+def update_pipeline_progress(n_intervals, job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return 0, "", "", True
+    percent = round(status["progress"] * 100)
+    if status["state"] == "failed":
+        return percent, "", f"適用に失敗しました ({status['error']})", True
+    if status["state"] == "cancelled":
+        return percent, "", "適用を取り消しました", True
+    if status["state"] == "done":
+        result = status["result"]
+        message = f"{os.path.basename(result['csv'])} に保存しました"
+        if result["missing"]:
+            message += f" (適用先にない列: {', '.join(result['missing'])})"
+        return 100, "100%", message, True
+    return percent, f"{percent}%", f"適用中... {status['message']}", False
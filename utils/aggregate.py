@@ -0,0 +1,106 @@
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils import columnar
+
+
+# グループごとの件数・最頻値・最頻値の割合(%)・ユニーク数を求める
+# 値ごとの件数を1回だけ数え、グループ内で件数の多い順に並べた先頭を最頻値とする
+# (同数の場合は Series.mode と同じく小さい値を選ぶ)
+def grouped_mode(df: pd.DataFrame, by: str, column: str) -> pd.DataFrame:
+    counts = df.groupby(by)[column].count()
+    value_counts = df.groupby([by, column]).size()
+    return _mode_table(counts, value_counts, column)
+
+
+def _mode_table(
+    counts: pd.Series, value_counts: pd.Series, column: str
+) -> pd.DataFrame:
+    value_counts = value_counts.rename(0).sort_index()
+    value_counts = value_counts.sort_values(ascending=False, kind="stable")
+    top = value_counts[~value_counts.index.get_level_values(0).duplicated()]
+    top = top.reset_index(level=1)
+    result = pd.DataFrame(
+        {
+            "count": counts,
+            "mode": top[column].reindex(counts.index),
+            "mode_share": top[0].reindex(counts.index) / counts * 100,
+            "nunique": value_counts.groupby(level=0).size().reindex(counts.index),
+        }
+    )
+    result["nunique"] = result["nunique"].fillna(0).astype(int)
+    return result.reset_index()
+
+
+# 列指向のコピーから指定した列だけをバッチごとに読み出す
+def _iter_batches(path: str, columns: List[str]) -> Iterator[pd.DataFrame]:
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).select(columns).to_pandas()
+
+
+# grouped_mode と同じ集計をファイル全体を読み込まずに行う (バッチごとの件数を足し合わせる)
+def scan_grouped_mode(path: str, by: str, column: str) -> pd.DataFrame:
+    counts: Optional[pd.Series] = None
+    value_counts = pd.Series(dtype=np.int64)
+    for df in _iter_batches(path, [by, column]):
+        batch_counts = df.groupby(by)[column].count()
+        batch_value_counts = df.groupby([by, column]).size()
+        if counts is None:
+            counts, value_counts = batch_counts, batch_value_counts
+        else:
+            counts = counts.add(batch_counts, fill_value=0)
+            value_counts = value_counts.add(batch_value_counts, fill_value=0)
+    if counts is None:
+        return grouped_mode(pd.DataFrame(columns=[by, column]), by, column)
+    return _mode_table(counts.astype(np.int64), value_counts.astype(np.int64), column)
+
+
+# 列の値の組み合わせごとの件数をファイル全体を読み込まずに数える
+# 欠損を含む組み合わせは pandas の groupby と同じく除き、値の順に並べる
+def scan_counts(path: str, columns: List[str]) -> pd.Series:
+    total: Optional[pd.Series] = None
+    for df in _iter_batches(path, columns):
+        counts = df.groupby(columns).size()
+        total = counts if total is None else total.add(counts, fill_value=0)
+    if total is None:
+        return pd.Series(dtype=np.int64)
+    return total.astype(np.int64).sort_index()
+
+
+# グループごとの件数・平均・標準偏差をファイル全体を読み込まずに求める
+# バッチごとの件数・平均・偏差平方和を合成する (中央値は1回の走査では求めないため省く)
+def scan_group_moments(path: str, by: str, column: str) -> pd.DataFrame:
+    n = mean = m2 = pd.Series(dtype=float)
+    for df in _iter_batches(path, [by, column]):
+        grouped = df.groupby(by)[column]
+        batch_n = grouped.count().astype(float)
+        batch_mean = grouped.mean().fillna(0.0)
+        batch_m2 = (grouped.var(ddof=0) * batch_n).fillna(0.0)
+        index = n.index.union(batch_n.index)
+        n1 = n.reindex(index, fill_value=0.0)
+        n2 = batch_n.reindex(index, fill_value=0.0)
+        total = n1 + n2
+        delta = batch_mean.reindex(index, fill_value=0.0) - mean.reindex(
+            index, fill_value=0.0
+        )
+        weight = (n2 / total.where(total > 0)).fillna(0.0)
+        mean = mean.reindex(index, fill_value=0.0) + delta * weight
+        m2 = (
+            m2.reindex(index, fill_value=0.0)
+            + batch_m2.reindex(index, fill_value=0.0)
+            + delta**2 * n1 * weight
+        )
+        n = total
+    return pd.DataFrame(
+        {
+            by: n.index,
+            "count": n.to_numpy(dtype=np.int64),
+            "mean": mean.where(n > 0).to_numpy(),
+            "std": np.sqrt(m2 / (n - 1)).where(n > 1).to_numpy(),
+        }
+    )
@@ -0,0 +1,212 @@
+import functools
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import config
+from utils import columnar
+
+Fingerprint = Tuple[str, int, int]
+
+
+# パス・サイズ・更新時刻からファイルを識別するキーを作る
+def file_fingerprint(path: str) -> Fingerprint:
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+# DataFrame・Seriesのメモリ使用量 (バイト, cudfにも対応)
+def frame_nbytes(df: Any) -> int:
+    usage = df.memory_usage(index=True, deep=True)
+    if hasattr(usage, "sum"):
+        usage = usage.sum()
+    return int(usage)
+
+
+class LRUCache:
+    # 値のメモリサイズの合計が max_bytes を超えたら古いものから捨てる
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # ヒット・ミスを数えずに参照する
+    def peek(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        nbytes = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            # 上限より大きい値は保持しない
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._discard(old_key)
+                self.evictions += 1
+
+    # キャッシュになければ loader で読み込む
+    # 同じキーへの同時アクセスでは読み込みは1回だけ行われる
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+dataset_cache = LRUCache(config.DATASET_CACHE_MAX_BYTES, frame_nbytes)
+_load_locks: Dict[Fingerprint, threading.Lock] = {}
+_load_locks_guard = threading.Lock()
+
+
+# 選択ファイルの指定列を読み込む (プロセス内で共有されるので返り値は変更しないこと)
+# 列ごとにキャッシュし、キャッシュにない列だけを列指向のコピーから読む
+def read_dataset(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    fingerprint = file_fingerprint(path)
+    if columns is None:
+        columns = columnar.column_names(path)
+    columns = list(dict.fromkeys(columns))
+
+    series = {c: dataset_cache.get(("column",) + fingerprint + (c,)) for c in columns}
+    missing = [c for c, s in series.items() if s is None]
+    if missing:
+        with _load_locks_guard:
+            lock = _load_locks.setdefault(fingerprint, threading.Lock())
+        with lock:
+            # 待っている間に他のリクエストが読み込んだ列は再利用する
+            for c in missing:
+                series[c] = dataset_cache.peek(("column",) + fingerprint + (c,))
+            missing = [c for c in missing if series[c] is None]
+            if missing:
+                loaded = columnar.read_columns(path, missing)
+                for c in missing:
+                    series[c] = loaded[c]
+                    dataset_cache.put(("column",) + fingerprint + (c,), loaded[c])
+    if not columns:
+        return pd.DataFrame()
+    return pd.concat([series[c] for c in columns], axis=1, copy=False)
+
+
+# コールバックの結果 (図・表) をJSONにしたものを保持する
+result_cache = LRUCache(config.RESULT_CACHE_MAX_BYTES, lambda entry: len(entry[1]))
+
+
+# ファイルと入力値が同じならコールバックの結果を再利用する
+# ignore にはボタンのクリック数など結果に関係しない引数名を指定する
+# ファイルのパスは引数 data で受け取ること
+def memoize_result(*ignore: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            arguments = signature.bind(*args, **kwargs).arguments
+            path = arguments.get("data")
+            if not path or not os.path.exists(path):
+                return func(*args, **kwargs)
+            inputs = json.dumps(
+                {k: v for k, v in arguments.items() if k not in ignore and k != "data"},
+                sort_keys=True,
+                default=str,
+            )
+            key = (
+                (f"{func.__module__}.{func.__qualname__}",)
+                + file_fingerprint(path)
+                + (inputs,)
+            )
+            entry = result_cache.get(key)
+            if entry is None:
+                result = func(*args, **kwargs)
+                entry = (
+                    isinstance(result, tuple),
+                    json.dumps(result, cls=PlotlyJSONEncoder),
+                )
+                result_cache.put(key, entry)
+            is_tuple, text = entry
+            result = json.loads(text)
+            return tuple(result) if is_tuple else result
+
+        return wrapper
+
+    return decorator
+
+
+# 削除されたファイルのキャッシュを破棄する
+def invalidate_path(path: str) -> None:
+    abspath = os.path.abspath(path)
+    for cache in (dataset_cache, result_cache):
+        cache.invalidate(
+            lambda key: isinstance(key, tuple) and len(key) > 1 and key[1] == abspath
+        )
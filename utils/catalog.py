@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+from utils.db import Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    n_rows INTEGER,
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_uploaded_at ON files (uploaded_at);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+
+class Catalog:
+    # アップロード済みファイルの一覧 (プロセスを再起動しても残る)
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = Database(db_path, SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._db.connect()
+
+    def register(self, path: str, uploaded_at: Optional[float] = None) -> None:
+        path = os.path.abspath(path)
+        with self._connect() as conn:
+            _upsert(conn, path, os.stat(path), uploaded_at)
+
+    def set_rows(self, path: str, n_rows: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE files SET n_rows = ? WHERE path = ?",
+                (n_rows, os.path.abspath(path)),
+            )
+
+    def remove(self, path: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+
+    def get(self, path: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not path:
+            return None
+        row = (
+            self._connect()
+            .execute("SELECT * FROM files WHERE path = ?", (os.path.abspath(path),))
+            .fetchone()
+        )
+        return None if row is None else dict(row)
+
+    # root直下の各フォルダにあるCSVを差分だけ反映する
+    # 更新時刻が変わっていないフォルダは一覧を読み飛ばし、登録済みのファイルだけを確認する
+    # (ファイルを上書きしてもフォルダの更新時刻は変わらないため)
+    # ファイルは更新時刻と大きさで変更を判定する
+    def scan(self, root: str) -> None:
+        if not os.path.isdir(root):
+            return
+        conn = self._connect()
+        known_folders = dict(conn.execute("SELECT path, mtime_ns FROM folders"))
+        seen_folders = set()
+        with conn:
+            for entry in os.scandir(root):
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                folder = os.path.abspath(entry.path)
+                seen_folders.add(folder)
+                mtime_ns = entry.stat().st_mtime_ns
+                if known_folders.get(folder) == mtime_ns:
+                    self._check_files(conn, folder)
+                    continue
+                self._scan_folder(conn, folder)
+                conn.execute(
+                    "INSERT OR REPLACE INTO folders (path, mtime_ns) VALUES (?, ?)",
+                    (folder, mtime_ns),
+                )
+            for folder in set(known_folders) - seen_folders:
+                conn.execute("DELETE FROM folders WHERE path = ?", (folder,))
+                conn.execute(
+                    "DELETE FROM files WHERE path LIKE ? ESCAPE '\\'",
+                    (_like_prefix(folder + os.sep),),
+                )
+
+    def _scan_folder(self, conn: sqlite3.Connection, folder: str) -> None:
+        known = _known_files(conn, folder)
+        found = set()
+        for entry in os.scandir(folder):
+            if entry.name.startswith(".") or not entry.name.lower().endswith(".csv"):
+                continue
+            path = os.path.abspath(entry.path)
+            found.add(path)
+            stat = entry.stat()
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                _upsert(conn, path, stat, stat.st_mtime)
+        for path in set(known) - found:
+            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    # 登録済みのファイルだけを確認し、変更・削除されたものを反映する
+    def _check_files(self, conn: sqlite3.Connection, folder: str) -> None:
+        for path, version in _known_files(conn, folder).items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                continue
+            if version != (stat.st_mtime_ns, stat.st_size):
+                _upsert(conn, path, stat, stat.st_mtime)
+
+    # ファイル名の部分一致で検索する (新しいものから順に1ページ分)
+    def search(
+        self, query: Optional[str], page: int, page_size: int
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        where = ""
+        params: List[Any] = []
+        if query:
+            where = "WHERE name LIKE ? ESCAPE '\\'"
+            params.append(f"%{_escape_like(query)}%")
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM files {where}", params).fetchone()[
+            0
+        ]
+        rows = conn.execute(
+            f"SELECT * FROM files {where} ORDER BY uploaded_at DESC, name "
+            "LIMIT ? OFFSET ?",
+            params + [page_size, max(page - 1, 0) * page_size],
+        ).fetchall()
+        return [dict(row) for row in rows], total
+
+
+# ファイルを登録する (登録済みなら大きさと更新時刻を更新し、変更されていれば行数を消す)
+# 呼び出し側のトランザクションの中で実行する
+def _upsert(
+    conn: sqlite3.Connection,
+    path: str,
+    stat: os.stat_result,
+    uploaded_at: Optional[float],
+) -> None:
+    conn.execute(
+        """
+        INSERT INTO files (path, name, folder, size, mtime_ns, uploaded_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (path) DO UPDATE SET
+            size = excluded.size,
+            mtime_ns = excluded.mtime_ns,
+            n_rows = CASE
+                WHEN files.mtime_ns = excluded.mtime_ns AND files.size = excluded.size
+                THEN files.n_rows
+            END
+        """,
+        (
+            path,
+            os.path.basename(path),
+            os.path.basename(os.path.dirname(path)),
+            stat.st_size,
+            stat.st_mtime_ns,
+            time.time() if uploaded_at is None else uploaded_at,
+        ),
+    )
+
+
+# フォルダ内の登録済みのファイル {パス: (更新時刻, 大きさ)}
+def _known_files(conn: sqlite3.Connection, folder: str) -> Dict[str, Tuple[int, int]]:
+    return {
+        row["path"]: (row["mtime_ns"], row["size"])
+        for row in conn.execute(
+            "SELECT path, mtime_ns, size FROM files WHERE path LIKE ? ESCAPE '\\'",
+            (_like_prefix(folder + os.sep),),
+        )
+    }
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _like_prefix(prefix: str) -> str:
+    return _escape_like(prefix) + "%"
+
+
+def file_label(row: Dict[str, Any]) -> str:
+    return f"{row['name']} ({row['folder']})"
+
+
+catalog = Catalog(config.CATALOG_PATH)
@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+
+from utils.sidecar import sidecar_path, temp_path
+
+CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+_convert_locks: Dict[str, threading.Lock] = {}
+_convert_locks_guard = threading.Lock()
+
+
+def columnar_path(path: str) -> str:
+    return sidecar_path(path, "arrow")
+
+
+def _source_metadata(path: str) -> Dict[bytes, bytes]:
+    stat = os.stat(path)
+    return {
+        b"source_size": str(stat.st_size).encode(),
+        b"source_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+
+
+# 変換できない値があった列の位置 (例: "In CSV column #2: Row #1001: ...")
+CONFLICT_COLUMN = re.compile(r"In CSV column #(\d+)")
+
+
+# 1ブロック目から推定した型に合わない値が後から出てきた列の型を広げる
+# 整数の列は浮動小数に、それ以外は文字列にする (pandasで読み込んだ場合と同じ扱い)
+def _widen(
+    error: pa.ArrowInvalid, schema: pa.Schema, types: Dict[str, pa.DataType]
+) -> bool:
+    match = CONFLICT_COLUMN.search(str(error))
+    if match is None or int(match.group(1)) >= len(schema):
+        return False
+    field = schema.field(int(match.group(1)))
+    if pa.types.is_string(field.type):
+        return False
+    types[field.name] = pa.float64() if pa.types.is_integer(field.type) else pa.string()
+    return True
+
+
+# CSVをArrow IPC形式(メモリマップで列単位に読める)に変換する
+# ブロックごとに読み書きするので、ファイル全体をメモリに載せない
+def convert_to_columnar(path: str) -> str:
+    dest = columnar_path(path)
+    tmp = temp_path(dest)
+    metadata = _source_metadata(path)
+    types: Dict[str, pa.DataType] = {}
+    try:
+        while True:
+            reader = pacsv.open_csv(
+                path,
+                read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                # pandasと同じく空文字列を欠損値として扱う
+                convert_options=pacsv.ConvertOptions(
+                    strings_can_be_null=True, column_types=types
+                ),
+            )
+            schema = reader.schema
+            try:
+                with pa.OSFile(tmp, "wb") as sink:
+                    with pa.ipc.new_file(
+                        sink, schema.with_metadata(metadata)
+                    ) as writer:
+                        for batch in reader:
+                            writer.write_batch(batch)
+                break
+            except pa.ArrowInvalid as e:
+                # 型を広げて最初から変換し直す
+                if not _widen(e, schema, types):
+                    raise
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dest
+
+
+def _is_fresh(path: str) -> bool:
+    dest = columnar_path(path)
+    if not os.path.exists(dest):
+        return False
+    try:
+        with pa.memory_map(dest) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except pa.ArrowInvalid:
+        return False
+    return metadata == _source_metadata(path)
+
+
+# 列指向のコピーがなければ(または古ければ)作成する
+def ensure_columnar(path: str) -> str:
+    abspath = os.path.abspath(path)
+    with _convert_locks_guard:
+        lock = _convert_locks.setdefault(abspath, threading.Lock())
+    with lock:
+        if not _is_fresh(path):
+            convert_to_columnar(path)
+    return columnar_path(path)
+
+
+def schema(path: str) -> pa.Schema:
+    with pa.memory_map(ensure_columnar(path)) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def column_names(path: str) -> List[str]:
+    return schema(path).names
+
+
+def numeric_columns(path: str) -> List[str]:
+    return [
+        field.name
+        for field in schema(path)
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)
+    ]
+
+
+# 欠損の数 (pandasと同じく浮動小数の列ではNaNも欠損として数える)
+# プロファイル・集計・欠損位置のいずれもこの定義を使う
+def missing_count(column: Any) -> int:
+    if pa.types.is_floating(column.type):
+        return column.null_count + (pc.sum(pc.is_nan(column)).as_py() or 0)
+    return column.null_count
+
+
+# 指定した列だけをメモリマップ経由で読み込む
+def read_columns(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    table = feather.read_table(ensure_columnar(path), columns=columns, memory_map=True)
+    return table.to_pandas()
@@ -0,0 +1,21 @@
+from typing import Any, List, Optional
+
+from utils import columnar
+from utils.aggregate import scan_counts
+from utils.streaming import TARGET_COLUMN, load_summary
+
+
+# target × カテゴリーの件数 ([target, 値, 件数] の並び)
+# 欠損値はpandasのgroupbyと同じく集計から除く
+def category_counts(path: str, column: str) -> Optional[List[List[Any]]]:
+    counts = load_summary(path)["target_counts"]
+    if column in counts:
+        return counts[column]
+    # カテゴリー数が多く取り込み時に集計しなかった列は、2列だけをバッチごとに読んで数える
+    names = columnar.column_names(path)
+    if TARGET_COLUMN not in names or column not in names:
+        return None
+    return [
+        [target, value, int(n)]
+        for (target, value), n in scan_counts(path, [TARGET_COLUMN, column]).items()
+    ]
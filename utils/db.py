@@ -0,0 +1,24 @@
+import os
+import sqlite3
+import threading
+
+
+class Database:
+    # 複数のワーカー(プロセス)から共有するsqliteデータベース
+    # 接続はスレッドごとに持ち、fork後に親の接続を使い回さないようプロセスIDも確認する
+    def __init__(self, db_path: str, schema: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(schema)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,65 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# 抽出を毎回同じ結果にするための乱数シード
+SAMPLE_SEED = 0
+# ガウスカーネルを打ち切る幅 (バンド幅の倍数)
+KERNEL_CUTOFF = 4.0
+
+
+# 上限を超える場合は無作為に抽出する (欠損値は除く)
+def sample_values(values: np.ndarray, sample_max: int) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) > sample_max:
+        rng = np.random.default_rng(SAMPLE_SEED)
+        values = rng.choice(values, sample_max, replace=False)
+    return values
+
+
+# Scottの規則 (scipy.stats.gaussian_kde の既定値と同じ)
+def scott_bandwidth(values: np.ndarray) -> float:
+    std = values.std(ddof=1) if len(values) > 1 else 0.0
+    return float(std * len(values) ** (-1 / 5)) if std > 0 else 0.0
+
+
+# 等間隔の格子上でヒストグラムを取り、ガウスカーネルをFFTで畳み込んで密度を求める
+def binned_kde(
+    values: np.ndarray, lo: float, hi: float, n_points: int, bandwidth: float
+) -> np.ndarray:
+    counts, edges = np.histogram(values, bins=n_points, range=(lo, hi))
+    dx = edges[1] - edges[0]
+    if bandwidth <= 0 or dx <= 0:
+        return counts / max(len(values) * dx, 1e-12)
+    half = min(int(np.ceil(KERNEL_CUTOFF * bandwidth / dx)), n_points)
+    kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * dx / bandwidth) ** 2)
+    kernel /= kernel.sum()
+    size = 1 << int(np.ceil(np.log2(n_points + 2 * half + 1)))
+    smoothed = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    density = smoothed[half : half + n_points] / (len(values) * dx)  # NOQA
+    return np.clip(density, 0, None)
+
+
+# 複数のグループの密度曲線を共通の格子で計算する
+# 戻り値は (格子の座標, グループごとの密度 (データがなければNone))
+def density_curves(
+    groups: List[np.ndarray], n_points: int, sample_max: int
+) -> Tuple[np.ndarray, List[Optional[np.ndarray]]]:
+    samples = [sample_values(values, sample_max) for values in groups]
+    bandwidths = [scott_bandwidth(values) for values in samples]
+    nonempty = [(v, bw) for v, bw in zip(samples, bandwidths) if len(v) > 0]
+    if not nonempty:
+        return np.array([]), [None for _ in groups]
+    # 曲線の裾まで描けるよう、値の範囲をバンド幅の分だけ広げる
+    lo = min(v.min() - KERNEL_CUTOFF * bw for v, bw in nonempty)
+    hi = max(v.max() + KERNEL_CUTOFF * bw for v, bw in nonempty)
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    edges = np.linspace(lo, hi, n_points + 1)
+    grid = (edges[:-1] + edges[1:]) / 2
+    curves: List[Optional[np.ndarray]] = [
+        binned_kde(values, lo, hi, n_points, bw) if len(values) > 0 else None
+        for values, bw in zip(samples, bandwidths)
+    ]
+    return grid, curves
@@ -0,0 +1,54 @@
+import urllib.parse
+import zlib
+from typing import Iterable, Iterator
+
+import flask
+import pandas as pd
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+# ファイルを一定サイズずつ読み出す
+def iter_file(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+
+# データフレームのチャンクを順にCSVへ変換する (ヘッダは最初のチャンクだけ)
+def iter_csv(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = urllib.parse.quote(filename)
+    return f"attachment; filename=\"{quoted}\"; filename*=UTF-8''{quoted}"
+
+
+# 生成しながら送信するレスポンス (メモリ上にファイル全体を持たない)
+def csv_response(chunks: Iterator[bytes], filename: str, compress: bool):
+    mimetype = "text/csv"
+    if compress:
+        chunks = iter_gzip(chunks)
+        filename = f"{filename}.gz"
+        mimetype = "application/gzip"
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": _content_disposition(filename)},
+    )
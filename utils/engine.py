@@ -0,0 +1,60 @@
+import importlib
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+import config
+
+
+class PandasEngine:
+    # page3で使うデータフレームの実装 (pandas または cudf) の違いを吸収する
+    # 加工処理自体は utils.plan の手順として実装し、エンジンには依存しない
+    name = "pandas"
+
+    def __init__(self, lib: Any = pd):
+        self.lib = lib
+
+    def from_pandas(self, df: pd.DataFrame) -> Any:
+        return df
+
+    def to_pandas(self, df: Any) -> pd.DataFrame:
+        return df
+
+
+class CudfEngine(PandasEngine):
+    name = "cudf"
+
+    def __init__(self):
+        super().__init__(importlib.import_module("cudf"))
+
+    def from_pandas(self, df: pd.DataFrame) -> Any:
+        return self.lib.from_pandas(df)
+
+    def to_pandas(self, df: Any) -> pd.DataFrame:
+        return df.to_pandas()
+
+
+def gpu_available() -> bool:
+    try:
+        importlib.import_module("cudf")
+        cuda = importlib.import_module("numba.cuda")
+        return bool(cuda.is_available())
+    except Exception:
+        # GPUのない環境ではcudfのimport自体が様々な例外で失敗する
+        return False
+
+
+ENGINES: Dict[str, Any] = {"pandas": PandasEngine, "cudf": CudfEngine}
+
+
+def get_engine(name: Optional[str] = None) -> PandasEngine:
+    name = name or config.DATAFRAME_ENGINE
+    if name == "auto":
+        name = "cudf" if gpu_available() else "pandas"
+    if name not in ENGINES:
+        raise ValueError(f"unknown dataframe engine: {name}")
+    return ENGINES[name]()
+
+
+def available_engines() -> List[str]:
+    return ["pandas", "cudf"] if gpu_available() else ["pandas"]
@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.linear_model import BayesianRidge
+
+import config
+from utils.jobs import Job
+from utils.plan import ReplaceColumns
+
+
+# 補完の対象にする列を数値の配列で返す (値が1つもない列は推定できないので除く)
+def _target_values(
+    ws: Any, engine: Any, cols: List[str]
+) -> Tuple[pd.DataFrame, np.ndarray, List[str]]:
+    values = engine.to_pandas(ws.materialize(cols))
+    x = values.to_numpy(dtype=float)
+    usable = ~np.isnan(x).all(axis=0)
+    cols = [name for name, keep in zip(cols, usable) if keep]
+    return values, x[:, usable], cols
+
+
+# 多重代入法をバックグラウンドで実行し、加工手順として返す
+# 全ての行で IterativeImputer と同じ順序 (欠損の少ない列から1列ずつ) で推定する
+# 反復ごとに進捗を報告するので、途中で取り消せる
+# 返り値は受け取った側で編集中のデータに追加する (実行を始めた時と同じ版の場合のみ)
+def impute_working_set(
+    job: Job, ws: Any, engine: Any, cols: List[str]
+) -> Dict[str, Any]:
+    job.report(0.0, "対象の列を準備しています")
+    values, x, cols = _target_values(ws, engine, cols)
+    filled = ChainedImputer(
+        config.IMPUTE_MAX_ITER, config.IMPUTE_TOL, 1, sequential=True
+    ).fit_transform(x, job, slice(0.05, 1.0))
+    imputed = pd.DataFrame(filled, columns=cols, index=values.index)
+    return {
+        "version": ws.version,
+        "step": ReplaceColumns(engine.from_pandas(imputed)),
+    }
+
+
+# 1列分の回帰モデルを推定する (欠損のない行で他の列から予測する)
+def _fit_column(x: np.ndarray, observed: np.ndarray, j: int) -> BayesianRidge:
+    others = np.delete(np.arange(x.shape[1]), j)
+    model = BayesianRidge()
+    model.fit(x[observed][:, others], x[observed, j])
+    return model
+
+
+# 欠損している行の値を推定値で置き換える (x を書き換える)
+def _predict_column(
+    x: np.ndarray, missing: np.ndarray, j: int, model: BayesianRidge
+) -> None:
+    rows = missing[:, j]
+    if rows.any():
+        x[rows, j] = model.predict(np.delete(x[rows], j, axis=1))
+
+
+class ChainedImputer:
+    # 連鎖方程式による多重代入法 (IterativeImputer と同じく BayesianRidge を使う)
+    # 既定では1回の反復で全ての列を前回の補完値から同時に推定する (列ごとに並列に実行できる)
+    # sequential=True の場合は欠損の少ない列から1列ずつ、直前に補完した値を使って推定する
+    # 補完値の変化が小さくなったら反復を打ち切る (IterativeImputer と同じ判定)
+    def __init__(self, max_iter: int, tol: float, n_jobs: int, sequential=False):
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_jobs = n_jobs
+        self.sequential = sequential
+        self.means: Optional[np.ndarray] = None
+        # 反復ごとの {列番号: モデル} (推定した順)
+        self.rounds: List[Dict[int, BayesianRidge]] = []
+
+    def fit(
+        self, x: np.ndarray, job: Optional[Job] = None, progress: slice = slice(0, 1)
+    ) -> "ChainedImputer":
+        self.fit_transform(x, job, progress)
+        return self
+
+    # 推定し、推定に使った行を補完した値を返す
+    # job を渡すと反復ごとに進捗を報告する (取り消された場合は JobCancelled)
+    def fit_transform(
+        self, x: np.ndarray, job: Optional[Job] = None, progress: slice = slice(0, 1)
+    ) -> np.ndarray:
+        missing = np.isnan(x)
+        # 値がない列は0で埋め、推定の対象にしない
+        observed = (~missing).sum(axis=0)
+        means = np.nansum(x, axis=0) / np.maximum(observed, 1)
+        self.means = means
+        # 列が1つだけの場合は平均値で埋めるだけにする (IterativeImputer と同じ)
+        targets = np.flatnonzero(
+            missing.any(axis=0) & (observed > 0) & (x.shape[1] > 1)
+        )
+        targets = targets[np.argsort(missing.sum(axis=0)[targets], kind="stable")]
+        filled = np.where(missing, means, x)
+        threshold = self.tol * np.max(np.abs(x[~missing]), initial=0.0)
+        span = progress.stop - progress.start
+        with Parallel(n_jobs=self.n_jobs, prefer="threads") as parallel:
+            for i in range(self.max_iter):
+                previous = filled
+                if self.sequential:
+                    filled = filled.copy()
+                    models = {}
+                    for j in targets.tolist():
+                        models[j] = _fit_column(filled, ~missing[:, j], j)
+                        _predict_column(filled, missing, j, models[j])
+                        if job is not None:
+                            job.check_cancelled()
+                else:
+                    models = dict(
+                        zip(
+                            targets.tolist(),
+                            parallel(
+                                delayed(_fit_column)(filled, ~missing[:, j], j)
+                                for j in targets
+                            ),
+                        )
+                    )
+                    filled = self._predict(filled, missing, models)
+                self.rounds.append(models)
+                # 行ごとの変化量の和の最大値 (IterativeImputer と同じ無限大ノルム)
+                change = np.linalg.norm(filled - previous, ord=np.inf)
+                if job is not None:
+                    job.report(
+                        progress.start + span * (i + 1) / self.max_iter,
+                        f"推定中 ({i + 1}回目, 変化量 {change:.3g})",
+                    )
+                if change < threshold:
+                    break
+        return filled
+
+    def _predict(
+        self, filled: np.ndarray, missing: np.ndarray, models: Dict[int, BayesianRidge]
+    ) -> np.ndarray:
+        result = filled.copy()
+        if self.sequential:
+            for j, model in models.items():
+                _predict_column(result, missing, j, model)
+            return result
+        for j, model in models.items():
+            rows = missing[:, j]
+            if rows.any():
+                result[rows, j] = model.predict(np.delete(filled[rows], j, axis=1))
+        return result
+
+    # 推定時と同じ順序で反復して欠損値を補完する
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        if self.means is None:
+            raise ValueError("推定 (fit) の前に補完はできません")
+        missing = np.isnan(x)
+        filled = np.where(missing, self.means, x)
+        for models in self.rounds:
+            filled = self._predict(filled, missing, models)
+        return filled
+
+
+# 大規模データ向けの多重代入法
+# 無作為に抽出した行で推定し、全行は一定行数ずつ補完する
+def impute_working_set_sampled(
+    job: Job, ws: Any, engine: Any, cols: List[str]
+) -> Dict[str, Any]:
+    job.report(0.0, "対象の列を準備しています")
+    values, x, cols = _target_values(ws, engine, cols)
+
+    rng = np.random.default_rng(0)
+    if len(x) > config.IMPUTE_SAMPLE_ROWS:
+        sample = x[
+            np.sort(rng.choice(len(x), config.IMPUTE_SAMPLE_ROWS, replace=False))
+        ]
+    else:
+        sample = x
+    imputer = ChainedImputer(
+        config.IMPUTE_MAX_ITER, config.IMPUTE_TOL, config.IMPUTE_N_JOBS
+    ).fit(sample, job, slice(0.05, 0.6))
+
+    chunk_rows = max(config.IMPUTE_CHUNK_ROWS, 1)
+    n_chunks = max(-(-len(x) // chunk_rows), 1)
+    parts = []
+    for i, start in enumerate(range(0, len(x), chunk_rows)):
+        stop = start + chunk_rows
+        parts.append(imputer.transform(x[start:stop]))
+        job.report(0.6 + 0.4 * (i + 1) / n_chunks, f"補完中 ({i + 1}/{n_chunks})")
+    imputed = pd.DataFrame(
+        np.concatenate(parts) if parts else np.empty((0, len(cols))),
+        columns=cols,
+        index=values.index,
+    )
+    return {
+        "version": ws.version,
+        "step": ReplaceColumns(engine.from_pandas(imputed)),
+    }
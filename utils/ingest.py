@@ -0,0 +1,80 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from utils import columnar, nullmask, outliers, profile, streaming
+from utils.catalog import catalog
+from utils.jobs import Job, jobs
+
+# サイドバーに表示する取り込み状況の件数
+RECENT_LIMIT = 10
+
+
+# CSVとして読めるかを確認する
+def validate_csv(path: str) -> None:
+    if not path.lower().endswith(".csv"):
+        raise ValueError("CSVファイルではありません")
+    if os.path.getsize(path) == 0:
+        raise ValueError("ファイルが空です")
+    head = pd.read_csv(path, nrows=100)
+    if len(head.columns) == 0:
+        raise ValueError("列がありません")
+
+
+# 取り込み時に順に実行する処理 (表示名, 処理)
+STAGES: List[Tuple[str, Callable[[str], Any]]] = [
+    ("検証", validate_csv),
+    ("列指向形式に変換", columnar.ensure_columnar),
+    ("プロファイル集計", profile.load_profile),
+    ("集計", streaming.load_summary),
+    ("欠損位置の集計", nullmask.load_null_masks),
+    ("四分位数の集計", outliers.load_quantiles),
+]
+
+
+def ingest_file(job: Job, path: str) -> Dict[str, Any]:
+    for i, (name, stage) in enumerate(STAGES):
+        job.report(i / len(STAGES), name)
+        stage(path)
+    n_rows = profile.load_profile(path)["n_rows"]
+    catalog.set_rows(path, n_rows)
+    job.report(1.0, "完了")
+    return {"path": path, "n_rows": n_rows}
+
+
+# アップロード完了したファイルの取り込みをバックグラウンドで開始する
+def submit_ingest(path: str) -> str:
+    return jobs.submit(
+        ingest_file,
+        path,
+        label=os.path.basename(path),
+        owner=os.path.abspath(path),
+        kind="ingest",
+    )
+
+
+# 取り込みが済んでいるか (カタログに行数が記録されていれば済み)
+def is_ingested(path: str) -> bool:
+    row = catalog.get(path)
+    return row is None or row["n_rows"] is not None
+
+
+# 最後の取り込みの状態 (どのワーカーで開始したものでもよい)
+def last_ingest(path: str) -> Optional[Dict[str, Any]]:
+    return jobs.latest("ingest", os.path.abspath(path))
+
+
+# 取り込みが済んでおらず実行中でもなければ開始する
+# 失敗したものは再実行しない (ワーカーが停止して中断したものは再実行する)
+def ensure_ingested(path: str) -> None:
+    if is_ingested(path):
+        return
+    status = last_ingest(path)
+    if status is None or status["state"] == "done" or status["lost"]:
+        submit_ingest(path)
+
+
+# どのワーカーで受け付けた取り込みも表示できるよう、共有の状態から読む
+def recent_statuses() -> List[Dict[str, Any]]:
+    return jobs.recent("ingest", RECENT_LIMIT)
@@ -0,0 +1,417 @@
+import json
+import os
+import pickle
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import config
+from utils.db import Database
+
+# 完了したジョブの情報を残しておく時間 (秒)
+FINISHED_JOB_TTL_SECONDS = 60 * 60
+# 受け取られていない結果を残しておく時間 (秒)
+UNFETCHED_RESULT_TTL_SECONDS = 24 * 60 * 60
+# 実行中・順番待ちのジョブが動いていることを記録する間隔 (秒)
+HEARTBEAT_SECONDS = 10
+# 一定時間記録が途絶えたジョブ (ワーカーが停止したもの) の失敗理由
+LOST_ERROR = "処理していたワーカーが停止しました"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    owner TEXT,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL,
+    message TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_kind_created_at ON jobs (kind, created_at);
+CREATE INDEX IF NOT EXISTS jobs_owner_state ON jobs (owner, state);
+"""
+
+# 以前の版で作成したデータベースに追加する列
+ADDED_COLUMNS = {
+    "cancel_requested": "INTEGER NOT NULL DEFAULT 0",
+    "result_path": "TEXT",
+    "updated_at": "REAL",
+}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, db: Database, kind: str, label: str, owner: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.state = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._db = db
+
+    # 処理側から進捗(0〜1)を報告する
+    # 取り消しが要求されていれば JobCancelled を送出して処理を中断させる
+    def report(self, progress: float, message: str = "") -> None:
+        self.progress = min(max(progress, 0.0), 1.0)
+        if message:
+            self.message = message
+        self.save()
+        self.check_cancelled()
+
+    def check_cancelled(self) -> None:
+        row = (
+            self._db.connect()
+            .execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,))
+            .fetchone()
+        )
+        if row is not None and row["cancel_requested"]:
+            raise JobCancelled()
+
+    def insert(self) -> None:
+        with self._db.connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (
+                    id, kind, label, owner, state, progress, message, created_at,
+                    updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    self.id,
+                    self.kind,
+                    self.label,
+                    self.owner,
+                    self.state,
+                    self.progress,
+                    self.message,
+                    self.created_at,
+                    self.created_at,
+                ),
+            )
+
+    # 状態をデータベースに書き込み、他のワーカーからも参照できるようにする
+    def save(self) -> None:
+        with self._db.connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET
+                    state = ?, progress = ?, message = ?, error = ?, finished_at = ?,
+                    updated_at = ?
+                WHERE id = ?
+                """,
+                (
+                    self.state,
+                    self.progress,
+                    self.message,
+                    self.error,
+                    self.finished_at,
+                    time.time(),
+                    self.id,
+                ),
+            )
+
+    # 結果を保存する (JSONにできないものはファイルに書き出す)
+    def save_result(self, result_dir: str) -> None:
+        result_text = None
+        result_path = None
+        try:
+            result_text = json.dumps(self.result)
+        except (TypeError, ValueError):
+            os.makedirs(result_dir, exist_ok=True)
+            result_path = os.path.join(result_dir, f"{self.id}.pkl")
+            with open(f"{result_path}.tmp", "wb") as f:
+                pickle.dump(self.result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{result_path}.tmp", result_path)
+        with self._db.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET result = ?, result_path = ? WHERE id = ?",
+                (result_text, result_path, self.id),
+            )
+
+
+class JobManager:
+    # 時間のかかる処理をリクエストのスレッドから切り離して実行する
+    # 処理は受け付けたワーカーで動き、状態は共有データベースで参照する
+    # 依頼元(owner)ごとに同時に実行する数を制限し、超えた分は順番待ちにする
+    # 実行中の数は共有データベースで数えるので、制限は全てのワーカーを合わせた数になる
+    # 実行中・順番待ちのジョブは定期的に記録を更新し、stale_seconds 以上途絶えたもの
+    # (ワーカーが停止したもの) は失敗として扱う
+    def __init__(
+        self,
+        max_workers: int,
+        db_path: str,
+        per_owner: int,
+        result_dir: str,
+        stale_seconds: int,
+    ):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._db = Database(db_path, SCHEMA)
+        self._migrate()
+        self.per_owner = per_owner
+        self.result_dir = result_dir
+        self.stale_seconds = stale_seconds
+        self._last_expire = 0.0
+        self._lock = threading.Lock()
+        # このワーカーで受け付けて終わっていないジョブ
+        self._jobs: Dict[str, Job] = {}
+        self._waiting: Deque[Tuple[Job, Callable[..., Any], tuple]] = deque()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _migrate(self) -> None:
+        with self._db.connect() as conn:
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in ADDED_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        label: str = "",
+        owner: Optional[str] = None,
+        kind: str = "",
+    ) -> str:
+        job = Job(self._db, kind, label, owner)
+        self._purge()
+        job.insert()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._waiting.append((job, func, args))
+        self._dispatch()
+        return job.id
+
+    # 順番待ちのジョブを、依頼元ごとの実行中の数が上限に達していなければ開始する
+    def _dispatch(self) -> None:
+        with self._lock:
+            for entry in list(self._waiting):
+                job = entry[0]
+                started = self._claim(job)
+                if started is None:
+                    continue
+                self._waiting.remove(entry)
+                if started:
+                    job.state = "running"
+                    self._executor.submit(self._run, *entry)
+                else:
+                    # 順番待ちの間に取り消された (または失敗として扱われた)
+                    self._jobs.pop(job.id, None)
+
+    # 実行中に変更できれば True、順番待ちでなくなっていれば False、上限に達していれば None
+    def _claim(self, job: Job) -> Optional[bool]:
+        now = time.time()
+        with self._db.connect() as conn:
+            self._expire(conn)
+            # 1つの文で数えて変更するので、他のワーカーと同時に上限を超えて開始しない
+            claimed = conn.execute(
+                """
+                UPDATE jobs SET state = 'running', updated_at = ?
+                WHERE id = ? AND state = 'queued' AND cancel_requested = 0 AND (
+                    owner IS NULL OR (
+                        SELECT COUNT(*) FROM jobs WHERE owner = ? AND state = 'running'
+                    ) < ?
+                )
+                """,
+                (now, job.id, job.owner, self.per_owner),
+            ).rowcount
+            if claimed:
+                return True
+            row = conn.execute(
+                "SELECT state, cancel_requested FROM jobs WHERE id = ?", (job.id,)
+            ).fetchone()
+        if row is None or row["state"] != "queued" or row["cancel_requested"]:
+            return False
+        return None
+
+    # 記録が途絶えた実行中・順番待ちのジョブを失敗にする
+    # 状態を参照するたびに書き込まないよう、記録の間隔より短い間は繰り返さない
+    def _expire(self, conn: Any) -> None:
+        now = time.time()
+        if now - self._last_expire < HEARTBEAT_SECONDS:
+            return
+        self._last_expire = now
+        conn.execute(
+            """
+            UPDATE jobs SET state = 'failed', error = ?, finished_at = ?
+            WHERE state IN ('queued', 'running')
+                AND (updated_at IS NULL OR updated_at < ?)
+            """,
+            (LOST_ERROR, now, now - self.stale_seconds),
+        )
+
+    # このワーカーのジョブが動いていることを記録し、他のワーカーで終わったジョブの
+    # 分だけ空いた枠で順番待ちのジョブを開始する
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                with self._lock:
+                    ids = list(self._jobs)
+                if ids:
+                    with self._db.connect() as conn:
+                        conn.execute(
+                            "UPDATE jobs SET updated_at = ? WHERE id IN "
+                            f"({', '.join('?' * len(ids))})",
+                            (time.time(), *ids),
+                        )
+                self._dispatch()
+            except Exception:
+                traceback.print_exc()
+
+    # 取り消しを要求する (実行中の処理は次に進捗を報告した時点で中断する)
+    def cancel(self, job_id: Optional[str]) -> None:
+        if not job_id:
+            return
+        with self._db.connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            # 順番待ちのものはすぐに取り消し済みにする
+            conn.execute(
+                "UPDATE jobs SET state = 'cancelled', message = ?, finished_at = ? "
+                "WHERE id = ? AND state = 'queued'",
+                ("取り消しました", time.time(), job_id),
+            )
+
+    def status(self, job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not job_id:
+            return None
+        with self._db.connect() as conn:
+            self._expire(conn)
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else _to_dict(row)
+
+    # 完了したジョブの結果を受け取る (受け取ったジョブは削除する)
+    def fetch(self, job_id: Optional[str]) -> Any:
+        if not job_id:
+            return None
+        conn = self._db.connect()
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE id = ? AND state = 'done'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row["result_path"]:
+            try:
+                with open(row["result_path"], "rb") as f:
+                    result = pickle.load(f)
+            except FileNotFoundError:
+                # 他のワーカーが先に受け取った
+                return None
+        else:
+            result = json.loads(row["result"]) if row["result"] else None
+        self._delete(row)
+        return result
+
+    # 種類ごとに新しいものから順に状態を返す
+    def recent(self, kind: str, limit: int) -> List[Dict[str, Any]]:
+        with self._db.connect() as conn:
+            self._expire(conn)
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? ORDER BY created_at DESC LIMIT ?",
+                (kind, limit),
+            ).fetchall()
+        return [_to_dict(row) for row in rows]
+
+    # 種類と依頼元ごとの最新のジョブの状態
+    def latest(self, kind: str, owner: str) -> Optional[Dict[str, Any]]:
+        with self._db.connect() as conn:
+            self._expire(conn)
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND owner = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (kind, owner),
+            ).fetchone()
+        return None if row is None else _to_dict(row)
+
+    def _run(self, job: Job, func: Callable[..., Any], args: tuple) -> None:
+        try:
+            # 順番待ちの間に取り消されたものは実行しない
+            job.check_cancelled()
+            job.result = func(job, *args)
+            job.save_result(self.result_dir)
+            job.progress = 1.0
+            job.state = "done"
+        except JobCancelled:
+            job.state = "cancelled"
+            job.message = "取り消しました"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = "failed"
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+            job.save()
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self._dispatch()
+
+    def _delete(self, row: Any) -> None:
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        if row["result_path"] and os.path.exists(row["result_path"]):
+            os.remove(row["result_path"])
+
+    # 結果を持たないジョブ (失敗・取り消し・結果のないもの) は完了後 FINISHED_JOB_TTL_SECONDS で、
+    # 受け取られていない結果は UNFETCHED_RESULT_TTL_SECONDS で削除する
+    def _purge(self) -> None:
+        now = time.time()
+        rows = (
+            self._db.connect()
+            .execute(
+                """
+                SELECT * FROM jobs WHERE finished_at IS NOT NULL AND (
+                    (result IS NULL AND result_path IS NULL AND finished_at < ?)
+                    OR finished_at < ?
+                )
+                """,
+                (
+                    now - FINISHED_JOB_TTL_SECONDS,
+                    now - UNFETCHED_RESULT_TTL_SECONDS,
+                ),
+            )
+            .fetchall()
+        )
+        for row in rows:
+            self._delete(row)
+
+
+def _to_dict(row: Any) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "label": row["label"],
+        "state": row["state"],
+        "progress": row["progress"],
+        "message": row["message"],
+        "error": row["error"],
+        # ワーカーが停止して失敗として扱ったもの (やり直してよい)
+        "lost": row["state"] == "failed" and row["error"] == LOST_ERROR,
+        "result": json.loads(row["result"]) if row["result"] else None,
+    }
+
+
+jobs = JobManager(
+    config.JOB_WORKERS,
+    config.JOB_DB_PATH,
+    config.JOB_MAX_PER_USER,
+    config.JOB_RESULT_DIR,
+    config.JOB_STALE_SECONDS,
+)
@@ -0,0 +1,27 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from utils.streaming import load_summary
+
+
+# 集計済みの値から相関行列を求める (pandasのcorrと同じく欠損はペアごとに除く)
+# 数値でない列は除く
+def correlation(path: str, columns: List[str]) -> pd.DataFrame:
+    summary = load_summary(path)
+    moments = summary["moments"]
+    index = {name: i for i, name in enumerate(summary["numeric"])}
+    columns = [name for name in columns if name in index]
+    pick = [index[name] for name in columns]
+    ix = np.ix_(pick, pick)
+    n = np.array(moments["n"])[ix]
+    sums = np.array(moments["sums"])[ix]
+    squares = np.array(moments["squares"])[ix]
+    products = np.array(moments["products"])[ix]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = n * products - sums * sums.T
+        var = n * squares - sums * sums
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < 2] = np.nan
+    return pd.DataFrame(np.clip(corr, -1, 1), index=columns, columns=columns)
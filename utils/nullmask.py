@@ -0,0 +1,122 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import config
+from utils import columnar
+from utils.cache import LRUCache, file_fingerprint
+from utils.sidecar import sidecar_path, temp_path
+
+# 1バイトに含まれる1のビット数
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+class NullMasks:
+    # 列ごとの欠損位置を1行1ビットに詰めて保持する (欠損のない列は持たない)
+    def __init__(self, names: List[str], n_rows: int, masks: Dict[str, np.ndarray]):
+        self.names = names
+        self.n_rows = n_rows
+        self.masks = masks
+
+    def nbytes(self) -> int:
+        return sum(mask.nbytes for mask in self.masks.values())
+
+    def null_counts(self) -> Dict[str, int]:
+        return {
+            name: int(POPCOUNT[self.masks[name]].sum()) if name in self.masks else 0
+            for name in self.names
+        }
+
+    # [i, j] は列iと列jが同時に欠損している行数 (対角は列ごとの欠損数)
+    def co_missing(self) -> pd.DataFrame:
+        names = list(self.masks)
+        matrix = np.zeros((len(names), len(names)), dtype=np.int64)
+        for i, a in enumerate(names):
+            for j in range(i, len(names)):
+                both = self.masks[a] & self.masks[names[j]]
+                matrix[i, j] = matrix[j, i] = POPCOUNT[both].sum()
+        return pd.DataFrame(matrix, index=names, columns=names)
+
+
+def null_masks_path(path: str) -> str:
+    return sidecar_path(path, "nulls.npz")
+
+
+# 列指向のコピーを1回だけ走査し、欠損位置をビットに詰める
+def build_null_masks(path: str) -> NullMasks:
+    bits: Dict[str, List[np.ndarray]] = {}
+    # 8行に満たない端数は次のバッチとまとめて詰める
+    carry: Dict[str, np.ndarray] = {}
+    n_rows = 0
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        names = reader.schema.names
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for name in names:
+                column = batch.column(name)
+                if name not in bits and columnar.missing_count(column) == 0:
+                    continue
+                if name not in bits:
+                    # 初めて欠損が見つかった列は、それまでの行を欠損なしとして埋める
+                    bits[name] = [np.zeros(n_rows // 8, dtype=np.uint8)]
+                    carry[name] = np.zeros(n_rows % 8, dtype=bool)
+                is_null = pc.is_null(column, nan_is_null=True).to_numpy(
+                    zero_copy_only=False
+                )
+                is_null = np.concatenate([carry[name], is_null])
+                whole = len(is_null) // 8 * 8
+                bits[name].append(np.packbits(is_null[:whole]))
+                carry[name] = is_null[whole:]
+            n_rows += batch.num_rows
+    masks = {
+        name: np.concatenate(bits[name] + [np.packbits(carry[name])]) for name in bits
+    }
+    return NullMasks(names, n_rows, masks)
+
+
+def _save(path: str, masks: NullMasks) -> None:
+    stat = os.stat(path)
+    dest = null_masks_path(path)
+    tmp = temp_path(dest)
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+            names=np.array(masks.names, dtype=str),
+            n_rows=np.array(masks.n_rows),
+            masked=np.array(list(masks.masks), dtype=str),
+            **{f"mask_{i}": mask for i, mask in enumerate(masks.masks.values())},
+        )
+    os.replace(tmp, dest)
+
+
+def _read_or_build(path: str) -> NullMasks:
+    stat = os.stat(path)
+    try:
+        with np.load(null_masks_path(path)) as data:
+            if data["source"].tolist() == [stat.st_size, stat.st_mtime_ns]:
+                masked = data["masked"].tolist()
+                return NullMasks(
+                    data["names"].tolist(),
+                    int(data["n_rows"]),
+                    {name: data[f"mask_{i}"] for i, name in enumerate(masked)},
+                )
+    except (OSError, ValueError, KeyError):
+        pass
+    masks = build_null_masks(path)
+    _save(path, masks)
+    return masks
+
+
+mask_cache = LRUCache(config.PROFILE_CACHE_MAX_BYTES, lambda masks: masks.nbytes())
+
+
+# 欠損位置を返す (なければ作成する)
+def load_null_masks(path: str) -> NullMasks:
+    key = ("nulls",) + file_fingerprint(path)
+    return mask_cache.get_or_load(key, lambda: _read_or_build(path))
@@ -0,0 +1,95 @@
+import os
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import config
+from utils import columnar
+from utils.cache import dataset_cache, file_fingerprint
+from utils.profile import profile_cache
+from utils.sidecar import load_json
+
+# 外れ値の行に付ける元データの行番号の列名
+ROW_COLUMN = "行番号"
+
+
+# 数値列ごとの第1・第3四分位数 (pandasのquantileと同じく線形補間)
+def build_quantiles(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    quantiles = {}
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+        for name in columnar.numeric_columns(path):
+            q1, q3 = pc.quantile(table[name], q=[0.25, 0.75]).to_pylist()
+            quantiles[name] = [q1, q3]
+    return {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "columns": quantiles,
+    }
+
+
+def load_quantiles(path: str) -> Dict[str, Any]:
+    key = ("quantiles",) + file_fingerprint(path)
+    return profile_cache.get_or_load(
+        key, lambda: load_json(path, "quantiles.json", build_quantiles)
+    )
+
+
+# IQR法で外れ値を探す (ファイルを1回だけ走査する)
+# 返り値は外れ値を含む行 (外れ値でない値は欠損にする、先頭 OUTLIER_ROWS_MAX 行まで)
+# attrs["counts"] に列ごとの外れ値の数、attrs["total"] に外れ値を含む行の総数を入れる
+def build_outliers(path: str) -> pd.DataFrame:
+    quantiles = load_quantiles(path)["columns"]
+    names = list(quantiles)
+    q1 = np.array([np.nan if q[0] is None else q[0] for q in quantiles.values()])
+    q3 = np.array([np.nan if q[1] is None else q[1] for q in quantiles.values()])
+    lower = q1 - 1.5 * (q3 - q1)
+    upper = q3 + 1.5 * (q3 - q1)
+
+    counts = np.zeros(len(names), dtype=np.int64)
+    total = 0
+    offset = 0
+    row_parts = []
+    value_parts = []
+    kept = 0
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            x = np.empty((batch.num_rows, len(names)))
+            for j, name in enumerate(names):
+                x[:, j] = batch.column(name).to_numpy(zero_copy_only=False)
+            with np.errstate(invalid="ignore"):
+                is_outlier = (x < lower) | (x > upper)
+            counts += is_outlier.sum(axis=0)
+            rows = np.flatnonzero(is_outlier.any(axis=1))
+            total += len(rows)
+            rows = rows[: max(config.OUTLIER_ROWS_MAX - kept, 0)]
+            if len(rows):
+                row_parts.append(rows + offset)
+                value_parts.append(np.where(is_outlier[rows], x[rows], np.nan))
+                kept += len(rows)
+            offset += batch.num_rows
+
+    df = pd.DataFrame(
+        np.concatenate(value_parts) if value_parts else np.empty((0, len(names))),
+        columns=names,
+    )
+    df.insert(
+        0,
+        ROW_COLUMN,
+        np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.int64),
+    )
+    df.attrs["counts"] = dict(zip(names, counts.tolist()))
+    df.attrs["total"] = total
+    return df
+
+
+# 外れ値の一覧を返す (プロセス内で共有されるので返り値は変更しないこと)
+def find_outliers(path: str) -> pd.DataFrame:
+    key = ("outliers",) + file_fingerprint(path)
+    return dataset_cache.get_or_load(key, lambda: build_outliers(path))
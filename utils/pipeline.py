@@ -0,0 +1,160 @@
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+import config
+from utils import columnar
+from utils.jobs import Job
+from utils.plan import Affine, DropColumns, DropMissingRows, FillValues, Plan
+from utils.save import write_chunks
+from utils.sidecar import temp_path
+
+# 他のファイルに適用できる手順 (推定済みの統計量だけで表せるもの)
+STEP_TYPES = {
+    step_type.__name__: step_type
+    for step_type in (DropColumns, DropMissingRows, FillValues, Affine)
+}
+
+
+def pipeline_path(name: str) -> str:
+    return os.path.join(config.PIPELINE_DIR, f"{name}.json")
+
+
+def _check_name(name: str) -> str:
+    name = (name or "").strip()
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        raise ValueError("手順の名前が正しくありません")
+    return name
+
+
+def _step_to_dict(step: Any) -> Dict[str, Any]:
+    if isinstance(step, (DropColumns, DropMissingRows)):
+        return {"type": type(step).__name__, "columns": list(step.columns)}
+    if isinstance(step, FillValues):
+        return {
+            "type": "FillValues",
+            "values": step.values,
+            "cast_float": step.cast_float,
+        }
+    if isinstance(step, Affine):
+        return {"type": "Affine", "shift": step.shift, "scale": step.scale}
+    raise ValueError("多重代入法の結果は他のファイルに適用できません")
+
+
+def _step_from_dict(data: Dict[str, Any]) -> Any:
+    step_type = STEP_TYPES[data.pop("type")]
+    if "columns" in data:
+        data["columns"] = tuple(data["columns"])
+    return step_type(**data)
+
+
+# 編集中のデータの加工手順 (元に戻した手順は含めない) を名前を付けて保存する
+# 統計量は編集中のデータから推定したものをそのまま使う
+def save_pipeline(name: str, ws: Any) -> str:
+    name = _check_name(name)
+    state = {
+        "name": name,
+        "source": ws.source,
+        "created_at": time.time(),
+        "columns": list(ws.base.columns),
+        "steps": [_step_to_dict(step) for step in ws.plan.steps],
+    }
+    os.makedirs(config.PIPELINE_DIR, exist_ok=True)
+    dest = pipeline_path(name)
+    tmp = temp_path(dest)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, dest)
+    return dest
+
+
+def load_pipeline(name: str) -> Tuple[Dict[str, Any], Plan]:
+    with open(pipeline_path(_check_name(name)), encoding="utf-8") as f:
+        state = json.load(f)
+    steps = tuple(_step_from_dict(dict(step)) for step in state["steps"])
+    return state, Plan(steps)
+
+
+# 保存した手順の一覧 (新しいものから順)
+def list_pipelines() -> List[Dict[str, Any]]:
+    if not os.path.isdir(config.PIPELINE_DIR):
+        return []
+    found = []
+    for entry in os.scandir(config.PIPELINE_DIR):
+        if entry.name.endswith(".json") and not entry.name.startswith("."):
+            found.append((entry.stat().st_mtime, entry.name[: -len(".json")]))
+    return [{"name": name, "updated_at": mtime} for mtime, name in sorted(found)[::-1]]
+
+
+# ファイル全体を読み込んだ場合と同じ型 (欠損を含む整数列は float64 など) にするための指定
+# 欠損を含まない部分だけを読み出すと、読み出した部分ごとに型が変わってしまうため
+def _file_dtypes(reader: Any) -> Dict[str, Any]:
+    has_nulls = [False] * len(reader.schema)
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        for j in range(batch.num_columns):
+            has_nulls[j] = has_nulls[j] or batch.column(j).null_count > 0
+    dtypes: Dict[str, Any] = {}
+    for field, nulls in zip(reader.schema, has_nulls):
+        if not nulls:
+            continue
+        if pa.types.is_integer(field.type):
+            dtypes[field.name] = "float64"
+        elif pa.types.is_boolean(field.type):
+            dtypes[field.name] = object
+    return dtypes
+
+
+# 列指向のコピーを一定行数ずつ読み出す (ファイル全体は読み込まない)
+def _iter_file(path: str, chunk_rows: int) -> Tuple[pa.Schema, int, Iterator[Any]]:
+    source = pa.memory_map(columnar.ensure_columnar(path))
+    reader = pa.ipc.open_file(source)
+    n_chunks = sum(
+        math.ceil(reader.get_batch(i).num_rows / chunk_rows)
+        for i in range(reader.num_record_batches)
+    )
+    dtypes = _file_dtypes(reader)
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        try:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for start in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(start, chunk_rows).to_pandas().astype(dtypes)
+        finally:
+            source.close()
+
+    return reader.schema, max(n_chunks, 1), chunks()
+
+
+# 保存した手順をファイルに適用し、結果を保存先に書き出す
+def apply_pipeline(
+    job: Job,
+    name: str,
+    path: str,
+    csv_path: str,
+    chunk_rows: int,
+    write_parquet: bool,
+) -> Dict[str, Any]:
+    state, plan = load_pipeline(name)
+    job.report(0.0, "列指向形式に変換しています")
+    schema, n_chunks, chunks = _iter_file(path, chunk_rows)
+    names = schema.names
+    columns = plan.columns(names)
+    saved = write_chunks(
+        job,
+        (plan.apply(chunk)[columns] for chunk in chunks),
+        n_chunks,
+        columns,
+        csv_path,
+        write_parquet,
+        schema,
+    )
+    # 手順の元になったファイルにあって、適用先にない列 (その列の手順は適用されない)
+    saved["missing"] = [c for c in state["columns"] if c not in names]
+    return saved
@@ -0,0 +1,259 @@
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from utils.cache import frame_nbytes
+
+
+# 浅いコピーに列を差し替える (変更していない列は元のフレームと共有される)
+def _with_columns(df: Any, columns: Dict[str, Any]) -> Any:
+    if not columns:
+        return df
+    out = df.copy(deep=False)
+    for name, values in columns.items():
+        out[name] = values
+    return out
+
+
+def _host_dict(series: Any) -> Dict[str, Any]:
+    if hasattr(series, "to_pandas"):
+        series = series.to_pandas()
+    return {k: (v.item() if hasattr(v, "item") else v) for k, v in series.items()}
+
+
+@dataclass(frozen=True)
+class DropColumns:
+    columns: Tuple[str, ...]
+
+    def apply(self, df: Any) -> Any:
+        return df.drop(columns=[c for c in self.columns if c in df.columns])
+
+
+@dataclass(frozen=True)
+class DropMissingRows:
+    # リストワイズ削除 (行の絞り込みなので表示時はPlan.row_labelsで評価する)
+    columns: Tuple[str, ...]
+
+    def apply(self, df: Any) -> Any:
+        cols = [c for c in self.columns if c in df.columns]
+        return df.dropna(subset=cols) if cols else df
+
+
+@dataclass(frozen=True)
+class FillValues:
+    # 列ごとの代入値 (平均値代入の場合は浮動小数に変換してから代入する)
+    values: Dict[str, Any]
+    cast_float: bool = False
+
+    def apply(self, df: Any) -> Any:
+        columns = {}
+        for name, value in self.values.items():
+            if name in df.columns:
+                col = df[name].astype(float) if self.cast_float else df[name]
+                columns[name] = col.fillna(value)
+        return _with_columns(df, columns)
+
+
+@dataclass(frozen=True)
+class Affine:
+    # (x - shift) / scale の変換 (正規化・標準化)
+    shift: Dict[str, float]
+    scale: Dict[str, float]
+
+    def apply(self, df: Any) -> Any:
+        columns = {
+            name: (df[name].astype(float) - shift) / self.scale[name]
+            for name, shift in self.shift.items()
+            if name in df.columns
+        }
+        return _with_columns(df, columns)
+
+
+@dataclass(frozen=True)
+class ReplaceColumns:
+    # 多重代入法など、統計量だけでは表せない処理の結果 (変更した列だけを保持する)
+    values: Any = field(compare=False)
+
+    def apply(self, df: Any) -> Any:
+        columns = {
+            name: self.values[name].reindex(df.index)
+            for name in self.values.columns
+            if name in df.columns
+        }
+        return _with_columns(df, columns)
+
+    def nbytes(self) -> int:
+        return frame_nbytes(self.values)
+
+
+def fit_fill_mean(values: Any) -> FillValues:
+    return FillValues(_host_dict(values.astype(float).mean()), cast_float=True)
+
+
+def fit_fill_mode(values: Any) -> FillValues:
+    return FillValues(_host_dict(values.mode().iloc[0]))
+
+
+def fit_normalize(values: Any) -> Affine:
+    values = values.astype(float)
+    col_min = values.min()
+    return Affine(_host_dict(col_min), _host_dict(values.max() - col_min))
+
+
+def fit_standardize(values: Any) -> Affine:
+    values = values.astype(float)
+    return Affine(_host_dict(values.mean()), _host_dict(values.std()))
+
+
+@dataclass(frozen=True)
+class Plan:
+    # 加工手順の記録 (データ自体は書き換えず、必要な部分だけを計算する)
+    steps: Tuple[Any, ...] = ()
+
+    def then(self, step: Any) -> "Plan":
+        return Plan(self.steps + (step,))
+
+    def columns(self, base_columns: List[str]) -> List[str]:
+        dropped: Set[str] = set()
+        for step in self.steps:
+            if isinstance(step, DropColumns):
+                dropped.update(step.columns)
+        return [c for c in base_columns if c not in dropped]
+
+    # 全ての手順を適用する (チャンク単位の処理にも使える)
+    def apply(self, df: Any) -> Any:
+        for step in self.steps:
+            df = step.apply(df)
+        return df
+
+    # 行の絞り込み以外の手順を適用する
+    def apply_columns(self, df: Any) -> Any:
+        for step in self.steps:
+            if not isinstance(step, DropMissingRows):
+                df = step.apply(df)
+        return df
+
+    # 行の絞り込み後に残る行ラベル (絞り込みがなければNone)
+    # 絞り込みに使う列だけを、その時点までの手順を適用して評価する
+    def row_labels(self, base: Any) -> Optional[Any]:
+        labels = None
+        for i, step in enumerate(self.steps):
+            if not isinstance(step, DropMissingRows):
+                continue
+            cols = [c for c in step.columns if c in base.columns]
+            if not cols:
+                continue
+            sub = base[cols] if labels is None else base.loc[labels, cols]
+            sub = Plan(self.steps[:i]).apply_columns(sub)
+            labels = sub.dropna().index
+        return labels
+
+    def nbytes(self) -> int:
+        return sum(step.nbytes() for step in self.steps if hasattr(step, "nbytes"))
+
+
+class WorkingSet:
+    # page3で編集中のデータ: 元データ(共有) + 加工手順の履歴
+    # 履歴は手順の列(line)と現在位置(position)で表し、元に戻す・やり直しは位置の移動だけで行う
+    # 各手順は変更した列の統計量(または列そのもの)だけを持つので、版ごとにデータを複製しない
+    # version は版ごとに異なる値 (手順の追加・元に戻す・やり直しのたびに新しくなる)
+    def __init__(
+        self,
+        source: str,
+        base: Any,
+        line: Tuple[Any, ...] = (),
+        position: Optional[int] = None,
+        rows_cache: Optional[Dict[int, Any]] = None,
+        version: Optional[str] = None,
+    ):
+        self.version = version or uuid.uuid4().hex
+        self.source = source
+        self.base = base
+        self.line = line
+        self.position = len(line) if position is None else position
+        self.plan = Plan(line[: self.position])
+        # 位置ごとの絞り込み後の行ラベル (同じ履歴上の版で共有する)
+        self._rows_cache = {} if rows_cache is None else rows_cache
+
+    def then(self, step: Any) -> "WorkingSet":
+        # 新しい手順を追加するとやり直し用の手順は破棄される
+        rows_cache = {k: v for k, v in self._rows_cache.items() if k <= self.position}
+        line = self.line[: self.position] + (step,)
+        return WorkingSet(self.source, self.base, line, len(line), rows_cache)
+
+    def can_undo(self) -> bool:
+        return self.position > 0
+
+    def can_redo(self) -> bool:
+        return self.position < len(self.line)
+
+    def undo(self) -> "WorkingSet":
+        position = max(self.position - 1, 0)
+        return WorkingSet(self.source, self.base, self.line, position, self._rows_cache)
+
+    def redo(self) -> "WorkingSet":
+        position = min(self.position + 1, len(self.line))
+        return WorkingSet(self.source, self.base, self.line, position, self._rows_cache)
+
+    def columns(self) -> List[str]:
+        return self.plan.columns(list(self.base.columns))
+
+    def rows(self) -> Optional[Any]:
+        if self.position not in self._rows_cache:
+            self._rows_cache[self.position] = self.plan.row_labels(self.base)
+        return self._rows_cache[self.position]
+
+    def n_rows(self) -> int:
+        rows = self.rows()
+        return len(self.base) if rows is None else len(rows)
+
+    def _slice(self, start: int, stop: int) -> Any:
+        rows = self.rows()
+        if rows is None:
+            return self.base.iloc[start:stop]
+        return self.base.loc[rows[start:stop]]
+
+    # 表示中のページだけを計算する
+    def page(self, page_current: int, page_size: int) -> Any:
+        start = page_current * page_size
+        chunk = self._slice(start, start + page_size)
+        return self.plan.apply_columns(chunk[self.columns()])
+
+    # 全ての手順を一定行数ずつ実行する (保存・ダウンロード用)
+    def iter_chunks(self, chunk_rows: int) -> Iterator[Any]:
+        columns = self.columns()
+        for start in range(0, self.n_rows(), chunk_rows):
+            chunk = self._slice(start, start + chunk_rows)
+            yield self.plan.apply_columns(chunk[columns])
+
+    # 指定した列(省略時は全列)について全ての手順を実行する
+    def materialize(self, columns: Optional[List[str]] = None) -> Any:
+        columns = self.columns() if columns is None else list(columns)
+        rows = self.rows()
+        df = self.base if rows is None else self.base.loc[rows]
+        return self.plan.apply_columns(df[columns])
+
+    def nbytes(self) -> int:
+        return frame_nbytes(self.base) + Plan(self.line).nbytes()
+
+    # ディスクへの退避用の状態 (元データはファイルから読み直せるので履歴だけを返す)
+    # 手順は個別に保存できるよう、見出し(元ファイル・現在位置)と手順の列に分けて返す
+    def state(self) -> Tuple[Dict[str, Any], Tuple[Any, ...]]:
+        header = {
+            "source": self.source,
+            "position": self.position,
+            "version": self.version,
+        }
+        return header, self.line
+
+
+def load_working_set(
+    header: Dict[str, Any], line: Tuple[Any, ...], read_base: Any
+) -> WorkingSet:
+    return WorkingSet(
+        header["source"],
+        read_base(header["source"]),
+        line,
+        header["position"],
+        version=header.get("version"),
+    )
@@ -0,0 +1,113 @@
+import functools
+import inspect
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+
+import config
+from utils.ingest import ensure_ingested, is_ingested, last_ingest
+from utils.sidecar import sidecar_path, temp_path
+from utils.streaming import is_large_file
+
+_sample_locks: Dict[str, threading.Lock] = {}
+_sample_locks_guard = threading.Lock()
+
+
+def sample_path(path: str) -> str:
+    return sidecar_path(path, "sample.csv")
+
+
+# ファイル内の無作為な位置から連続した行を読み出して概算用のCSVを作る
+# ファイル全体を読まないので、ファイルの大きさによらず短時間で作れる
+def build_sample(path: str) -> str:
+    dest = sample_path(path)
+    size = os.path.getsize(path)
+    n_blocks = max(config.PREVIEW_SAMPLE_BLOCKS, 1)
+    rows_per_block = max(config.PREVIEW_SAMPLE_ROWS // n_blocks, 1)
+    tmp = temp_path(dest)
+    with open(path, "rb") as source, open(tmp, "wb") as sink:
+        header = source.readline()
+        sink.write(header)
+        rng = np.random.default_rng(0)
+        offsets = np.sort(
+            rng.integers(source.tell(), max(size, source.tell() + 1), n_blocks)
+        )
+        position = source.tell()
+        for offset in offsets:
+            if offset > position:
+                source.seek(offset)
+                # 途中から読み始めた行は捨てる
+                source.readline()
+            for _ in range(rows_per_block):
+                line = source.readline()
+                if not line:
+                    break
+                if line.strip():
+                    sink.write(line if line.endswith(b"\n") else line + b"\n")
+            position = source.tell()
+    os.replace(tmp, dest)
+    return dest
+
+
+# 概算用のCSV (sample_path で作ったファイル) か
+def is_sample_path(path: str) -> bool:
+    basename = os.path.basename(path or "")
+    return basename.startswith(".") and basename.endswith(".sample.csv")
+
+
+# 概算用のCSVを返す (元ファイルより古ければ作り直す)
+def ensure_sample(path: str) -> str:
+    with _sample_locks_guard:
+        lock = _sample_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        dest = sample_path(path)
+        if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(path):
+            return dest
+        return build_sample(path)
+
+
+# 正確な集計が済んでいない大きなファイルか
+def is_approximate(path: str) -> bool:
+    if not path or not os.path.exists(path) or not is_large_file(path):
+        return False
+    if is_ingested(path):
+        return False
+    status = last_ingest(path)
+    return status is None or status["state"] != "failed" or status["lost"]
+
+
+# 集計に使うファイルを返す (概算の場合は抽出したCSV, 概算かどうか)
+# 概算の場合は正確な集計をバックグラウンドで開始する
+def resolve(path: str) -> Tuple[str, bool]:
+    if not is_approximate(path):
+        return path, False
+    ensure_ingested(path)
+    return ensure_sample(path), True
+
+
+# コールバックの引数 data (ファイルのパス) を概算用のCSVに差し替える
+# memoize_result より外側に付けると、概算と正確な結果は別々にキャッシュされる
+def preview_source(func: Callable[..., Any]) -> Callable[..., Any]:
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        bound = signature.bind(*args, **kwargs)
+        data = bound.arguments.get("data")
+        if data:
+            bound.arguments["data"] = resolve(data)[0]
+        return func(*bound.args, **bound.kwargs)
+
+    return wrapper
+
+
+# 概算を表示していることを知らせる文言
+def preview_note(path: str) -> str:
+    if not is_approximate(path):
+        return ""
+    return (
+        f"ファイルの一部 (約{config.PREVIEW_SAMPLE_ROWS:,}行) から求めた概算を表示しています。"
+        "全体の集計が終わると自動で切り替わります。"
+    )
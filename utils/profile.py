@@ -0,0 +1,78 @@
+import json
+import os
+from typing import Any, Dict, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import config
+from utils import columnar
+from utils.cache import LRUCache, file_fingerprint
+from utils.sidecar import load_json
+
+Profile = Dict[str, Any]
+
+# 欠損数にNaNを含めるようにした版
+PROFILE_VERSION = 2
+
+profile_cache = LRUCache(config.PROFILE_CACHE_MAX_BYTES, lambda p: len(json.dumps(p)))
+
+
+# 列名の接頭辞で分類し、それ以外は型で分類する
+def classify_column(name: str, dtype: pa.DataType) -> str:
+    if name.startswith("cat"):
+        return "cat"
+    if name.startswith("cont"):
+        return "cont"
+    if pa.types.is_integer(dtype) or pa.types.is_floating(dtype):
+        return "numeric"
+    return "text"
+
+
+# 列指向のコピーから列ごとの情報を集計する
+def build_profile(path: str) -> Profile:
+    stat = os.stat(path)
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+        columns = []
+        for field, column in zip(table.schema, table.columns):
+            info: Dict[str, Any] = {
+                "name": field.name,
+                "dtype": str(field.type),
+                "kind": classify_column(field.name, field.type),
+                "null_count": columnar.missing_count(column),
+                "min": None,
+                "max": None,
+            }
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                min_max = pc.min_max(column)
+                info["min"] = min_max["min"].as_py()
+                info["max"] = min_max["max"].as_py()
+            columns.append(info)
+        n_rows = table.num_rows
+    return {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "n_rows": n_rows,
+        "columns": columns,
+    }
+
+
+# プロファイルを返す (なければ作成する)
+def load_profile(path: str) -> Profile:
+    key = ("profile",) + file_fingerprint(path)
+    return profile_cache.get_or_load(
+        key, lambda: load_json(path, "profile.json", build_profile, PROFILE_VERSION)
+    )
+
+
+def columns_of_kind(profile: Profile, kind: str) -> List[str]:
+    return [c["name"] for c in profile["columns"] if c["kind"] == kind]
+
+
+def column_names(profile: Profile) -> List[str]:
+    return [c["name"] for c in profile["columns"]]
+
+
+def null_counts(profile: Profile) -> Dict[str, int]:
+    return {c["name"]: c["null_count"] for c in profile["columns"]}
@@ -0,0 +1,105 @@
+import math
+import os
+from typing import Any, Dict, Iterable, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils import columnar
+from utils.catalog import catalog
+from utils.jobs import Job
+from utils.sidecar import temp_path
+
+
+# 保存先と同じフォルダの一時ファイル (隠しファイルなのでファイル一覧には出ない)
+# 同じ名前での保存が同時に行われても互いの一時ファイルを上書き・削除しないようにする
+def _temp_path(path: str) -> str:
+    dirname, basename = os.path.split(path)
+    return temp_path(os.path.join(dirname, f".{basename}"))
+
+
+# チャンクごとに一時ファイルへ書き出し、最後に置き換える
+# 途中で失敗しても書きかけのファイルは保存先に残らない
+# source_schema は元ファイル全体の列の型 (先頭のチャンクから型が決まらない列に使う)
+def write_chunks(
+    job: Job,
+    chunks: Iterable[pd.DataFrame],
+    n_chunks: int,
+    columns: List[str],
+    csv_path: str,
+    write_parquet: bool,
+    source_schema: pa.Schema,
+) -> Dict[str, Any]:
+    parquet_path = f"{os.path.splitext(csv_path)[0]}.parquet"
+    csv_tmp = _temp_path(csv_path)
+    parquet_tmp = _temp_path(parquet_path)
+    writer = None
+    schema = None
+    saved: Dict[str, Any] = {"csv": csv_path}
+    try:
+        with open(csv_tmp, "w", encoding="utf-8", newline="") as f:
+            header = True
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=header)
+                header = False
+                if write_parquet:
+                    table = pa.Table.from_pandas(
+                        chunk, schema=schema, preserve_index=False
+                    )
+                    if writer is None:
+                        schema = _fixed_schema(table.schema, source_schema)
+                        table = table.cast(schema)
+                        writer = pq.ParquetWriter(parquet_tmp, schema)
+                    writer.write_table(table)
+                job.report((i + 1) / n_chunks, f"{i + 1}/{n_chunks}")
+            if header:
+                # 行がない場合もヘッダだけは書き出す
+                f.write(",".join(columns) + "\n")
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(parquet_tmp, parquet_path)
+            saved["parquet"] = parquet_path
+        os.replace(csv_tmp, csv_path)
+        catalog.register(csv_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        for tmp in (csv_tmp, parquet_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return saved
+
+
+# 先頭のチャンクで値が全て欠損の列は null 型になり、値のある次のチャンクを書き込めない
+# そのような列は元ファイルの型 (元ファイルにない列は文字列) にする
+def _fixed_schema(schema: pa.Schema, source_schema: pa.Schema) -> pa.Schema:
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            index = source_schema.get_field_index(field.name)
+            dtype = source_schema.field(index).type if index >= 0 else pa.string()
+            schema = schema.set(i, field.with_type(dtype))
+    return schema
+
+
+# 加工後のデータを一定行数ずつ保存する
+def save_working_set(
+    job: Job,
+    ws: Any,
+    engine: Any,
+    csv_path: str,
+    chunk_rows: int,
+    write_parquet: bool,
+) -> Dict[str, str]:
+    n_chunks = max(math.ceil(ws.n_rows() / chunk_rows), 1)
+    chunks = (engine.to_pandas(chunk) for chunk in ws.iter_chunks(chunk_rows))
+    return write_chunks(
+        job,
+        chunks,
+        n_chunks,
+        ws.columns(),
+        csv_path,
+        write_parquet,
+        columnar.schema(ws.source),
+    )
@@ -0,0 +1,206 @@
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.sidecar import temp_path
+
+SWEEP_INTERVAL_SECONDS = 60
+# どの見出しからも参照されなくなった手順のファイルを削除するまでの猶予 (秒)
+# 他のワーカーが古い見出しを読んでいる最中に削除しないようにする
+ORPHAN_GRACE_SECONDS = 60
+HEAD_NAME = "head.pkl"
+STEP_SUFFIX = ".step"
+
+
+class WorkingSetStore:
+    # セッションごとに編集中のデータを1つ保持する
+    # 更新のたびに共有フォルダへ書き出すので、どのワーカーからでも同じデータを参照できる
+    # メモリ上は上限と放置時間の範囲でキャッシュし、他のワーカーで更新されていれば読み直す
+    # 保持する値は nbytes() と state() (見出し, 手順の列) を持ち、
+    # load(見出し, 手順の列) で復元できること
+    # 手順は1つずつ別のファイルに保存し、更新時は新しい手順と見出しだけを書き出す
+    def __init__(
+        self,
+        max_bytes: int,
+        state_dir: str,
+        load: Callable[[Dict[str, Any], Tuple[Any, ...]], Any],
+        idle_seconds: int,
+        expire_seconds: int,
+    ):
+        self.max_bytes = max_bytes
+        self.state_dir = state_dir
+        self.idle_seconds = idle_seconds
+        self.expire_seconds = expire_seconds
+        self._load = load
+        # session_id -> (value, nbytes, last_access, version, 手順のファイル名)
+        self._values: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self.current_bytes = 0
+        self.evictions = 0
+        self.restores = 0
+
+    def _session_dir(self, session_id: str) -> str:
+        # セッションIDをファイル名として安全な文字だけにする
+        safe_id = re.sub(r"[^0-9A-Za-z_-]", "_", session_id)
+        return os.path.join(self.state_dir, safe_id)
+
+    def _head_path(self, session_id: str) -> str:
+        return os.path.join(self._session_dir(session_id), HEAD_NAME)
+
+    def _version(self, session_id: str) -> Optional[int]:
+        try:
+            return os.stat(self._head_path(session_id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._lock:
+            self._sweep()
+            version = self._version(session_id)
+            if version is None:
+                # 他のワーカーで破棄された(または期限切れの)セッション
+                self._remove(session_id)
+                return None
+            entry = self._values.get(session_id)
+            if entry is not None and entry[3] == version:
+                self._values[session_id] = entry[:2] + (time.monotonic(),) + entry[3:]
+                self._values.move_to_end(session_id)
+                return entry[0]
+            try:
+                value, names = self._read(session_id)
+            except FileNotFoundError:
+                # 元ファイルが削除されている場合は復元できない
+                self.discard(session_id)
+                return None
+            self.restores += 1
+            self._remove(session_id)
+            self._add(session_id, value, version, names)
+            return value
+
+    def _read(self, session_id: str) -> Tuple[Any, List[str]]:
+        session_dir = self._session_dir(session_id)
+        with open(os.path.join(session_dir, HEAD_NAME), "rb") as f:
+            head = pickle.load(f)
+        line = []
+        for name in head["steps"]:
+            with open(os.path.join(session_dir, name), "rb") as f:
+                line.append(pickle.load(f))
+        return self._load(head["header"], tuple(line)), head["steps"]
+
+    def put(self, session_id: str, value: Any) -> None:
+        with self._lock:
+            session_dir = self._session_dir(session_id)
+            os.makedirs(session_dir, exist_ok=True)
+            header, line = value.state()
+            # 前回書き出した手順 (同じオブジェクト) はファイルを使い回す
+            previous: List[Tuple[Any, str]] = []
+            entry = self._values.get(session_id)
+            if entry is not None:
+                previous = list(zip(entry[0].state()[1], entry[4]))
+            names = []
+            for i, step in enumerate(line):
+                if (
+                    i < len(previous)
+                    and previous[i][0] is step
+                    and os.path.exists(os.path.join(session_dir, previous[i][1]))
+                ):
+                    names.append(previous[i][1])
+                    continue
+                name = f"{uuid.uuid4().hex}{STEP_SUFFIX}"
+                _write_pickle(os.path.join(session_dir, name), step)
+                names.append(name)
+            _write_pickle(
+                os.path.join(session_dir, HEAD_NAME),
+                {"header": header, "steps": names},
+            )
+            self._remove(session_id)
+            self._add(session_id, value, self._version(session_id), names)
+            self._remove_orphans(session_dir, names)
+            self._sweep()
+
+    def discard(self, session_id: str) -> None:
+        with self._lock:
+            self._remove(session_id)
+            shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._values),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "restores": self.restores,
+            }
+
+    def _add(
+        self, session_id: str, value: Any, version: Optional[int], names: List[str]
+    ) -> None:
+        nbytes = value.nbytes()
+        self._values[session_id] = (value, nbytes, time.monotonic(), version, names)
+        self.current_bytes += nbytes
+        # 上限を超えたら使われていない順にメモリから外す (直近のセッションは残す)
+        while self.current_bytes > self.max_bytes and len(self._values) > 1:
+            self._remove(next(iter(self._values)))
+            self.evictions += 1
+
+    def _remove(self, session_id: str) -> Optional[Any]:
+        entry = self._values.pop(session_id, None)
+        if entry is None:
+            return None
+        self.current_bytes -= entry[1]
+        return entry[0]
+
+    # 元に戻した後に新しい手順を加えるなどして参照されなくなった手順を削除する
+    def _remove_orphans(self, session_dir: str, names: List[str]) -> None:
+        keep = set(names)
+        expire_before = time.time() - ORPHAN_GRACE_SECONDS
+        for entry in os.scandir(session_dir):
+            if (
+                entry.name.endswith(STEP_SUFFIX)
+                and entry.name not in keep
+                and entry.stat().st_mtime < expire_before
+            ):
+                os.remove(entry.path)
+
+    # 放置されたセッションをメモリから外し、期限切れのデータを削除する
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        idle = [
+            session_id
+            for session_id, entry in self._values.items()
+            if now - entry[2] > self.idle_seconds
+        ]
+        for session_id in idle:
+            self._remove(session_id)
+            self.evictions += 1
+        if not os.path.isdir(self.state_dir):
+            return
+        expire_before = time.time() - self.expire_seconds
+        for entry in os.scandir(self.state_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                updated = os.stat(os.path.join(entry.path, HEAD_NAME)).st_mtime
+            except FileNotFoundError:
+                updated = entry.stat().st_mtime
+            if updated < expire_before:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# 一時ファイルに書いてから置き換える (他のワーカーが書きかけのファイルを読まないように)
+def _write_pickle(path: str, value: Any) -> None:
+    tmp = temp_path(path)
+    with open(tmp, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
@@ -0,0 +1,52 @@
+import glob
+import json
+import os
+import threading
+from typing import Any, Callable, Dict
+
+
+# 元ファイルと同じフォルダに隠しファイルとして付随データを置く
+# (例: data/xxx/train.csv -> data/xxx/.train.csv.arrow)
+def sidecar_path(path: str, suffix: str) -> str:
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, f".{basename}.{suffix}")
+
+
+# 書き込み用の一時ファイル (複数のワーカー・スレッドが同時に作っても重ならない名前にする)
+def temp_path(dest: str) -> str:
+    return f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def remove_sidecars(path: str) -> None:
+    dirname, basename = os.path.split(path)
+    # 概算用に抽出したCSV (.xxx.sample.csv) の付随データ (..xxx.sample.csv.*) も消す
+    for pattern in (f".{glob.escape(basename)}.*", f"..{glob.escape(basename)}.*"):
+        for sidecar in glob.glob(os.path.join(dirname, pattern)):
+            os.remove(sidecar)
+
+
+# 元ファイルから集計したJSONを付随データとして保存し、元ファイルが変わっていなければ再利用する
+# build は source_size と source_mtime_ns を含む辞書を返すこと
+# 集計の内容を変えた場合は version を上げると、古い付随データは作り直される
+def load_json(
+    path: str, suffix: str, build: Callable[[str], Dict[str, Any]], version: int = 1
+) -> Dict[str, Any]:
+    stat = os.stat(path)
+    dest = sidecar_path(path, suffix)
+    try:
+        with open(dest, encoding="utf-8") as f:
+            data = json.load(f)
+        if (data["source_size"], data["source_mtime_ns"], data.get("version", 1)) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            version,
+        ):
+            return data
+    except (OSError, ValueError, KeyError):
+        pass
+    data = dict(build(path), version=version)
+    tmp = temp_path(dest)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, dest)
+    return data
@@ -0,0 +1,330 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import config
+from utils import columnar
+from utils.cache import file_fingerprint
+from utils.profile import classify_column, profile_cache
+from utils.sidecar import load_json
+
+TARGET_COLUMN = "target"
+# 一度に処理する行数
+BATCH_ROWS = 1_000_000
+# グループごとに集計するカテゴリー数の上限 (超えた列はグループ集計しない)
+GROUP_LEVELS_MAX = 1000
+# 付随データの版 (欠損数にNaNを含めるようにした版)
+SUMMARY_VERSION = 2
+
+Summary = Dict[str, Any]
+
+
+# 値を通し番号に置き換える (バッチをまたいで同じ値には同じ番号を振る)
+class LevelEncoder:
+    def __init__(self) -> None:
+        self.levels: Dict[Any, int] = {}
+
+    # 欠損値は -1 にする
+    def encode(self, array: pa.Array) -> np.ndarray:
+        encoded = pc.dictionary_encode(array)
+        if isinstance(encoded, pa.ChunkedArray):
+            encoded = encoded.combine_chunks()
+        lookup = np.array(
+            [
+                self.levels.setdefault(value, len(self.levels))
+                for value in encoded.dictionary.to_pylist()
+            ]
+            + [-1],
+            dtype=np.int64,
+        )
+        indices = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+        return lookup[indices]
+
+    # 値の昇順に並べた一覧
+    def sorted_levels(self) -> List[Any]:
+        return sorted(self.levels)
+
+
+# 配列の長さを必要な分だけ伸ばしながら番号ごとに足し込む
+def _add_at(total: np.ndarray, index: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    counts = np.bincount(index, weights=weights)
+    if len(counts) > len(total):
+        total = np.concatenate([total, np.zeros(len(counts) - len(total))])
+    total[: len(counts)] += counts
+    return total
+
+
+def _to_float(array: pa.Array) -> np.ndarray:
+    return array.to_numpy(zero_copy_only=False).astype(float)
+
+
+class SummaryBuilder:
+    # ファイルを1回だけ先頭から読み、メモリ使用量を抑えながら次をまとめて集計する
+    #   列ごと: 件数・欠損数・最小値・最大値・平均・標準偏差 (数値列)
+    #   カテゴリー列ごと: カテゴリーごとの件数と数値列の件数・平均・標準偏差
+    #   カテゴリー列 × target の件数
+    #   数値列の組ごと: 相関を求めるための件数・和・二乗和・積和
+    # 桁落ちを防ぐため、数値は最初のバッチの平均を引いてから集計する
+    def __init__(self, schema: pa.Schema):
+        self.names = schema.names
+        self.numeric = [
+            f.name
+            for f in schema
+            if pa.types.is_integer(f.type) or pa.types.is_floating(f.type)
+        ]
+        self.categorical = [
+            f.name for f in schema if classify_column(f.name, f.type) == "cat"
+        ]
+        k = len(self.numeric)
+        self.n_rows = 0
+        self.null_count = {name: 0 for name in self.names}
+        self.shift: Optional[np.ndarray] = None
+        self.minimum = np.full(k, np.inf)
+        self.maximum = np.full(k, -np.inf)
+        self.pair_n = np.zeros((k, k))
+        self.pair_sums = np.zeros((k, k))
+        self.pair_squares = np.zeros((k, k))
+        self.pair_products = np.zeros((k, k))
+        self.encoders = {name: LevelEncoder() for name in self.categorical}
+        self.has_target = TARGET_COLUMN in self.names
+        self.target_encoder = LevelEncoder()
+        self.group_count: Dict[str, np.ndarray] = {}
+        self.group_n: Dict[str, np.ndarray] = {}
+        self.group_sums: Dict[str, np.ndarray] = {}
+        self.group_squares: Dict[str, np.ndarray] = {}
+        self.target_pairs: Dict[str, Dict[tuple, int]] = {}
+        self.overflow: set = set()
+
+    def add(self, batch: pa.RecordBatch) -> None:
+        self.n_rows += batch.num_rows
+        for name in self.names:
+            self.null_count[name] += columnar.missing_count(batch.column(name))
+
+        k = len(self.numeric)
+        x = np.empty((batch.num_rows, k))
+        for i, name in enumerate(self.numeric):
+            x[:, i] = _to_float(batch.column(name))
+        valid = ~np.isnan(x)
+        if self.shift is None:
+            n = np.maximum(valid.sum(axis=0), 1)
+            self.shift = np.where(valid, x, 0.0).sum(axis=0) / n
+        self.minimum = np.fmin(self.minimum, np.fmin.reduce(x, axis=0, initial=np.inf))
+        self.maximum = np.fmax(self.maximum, np.fmax.reduce(x, axis=0, initial=-np.inf))
+        x = np.where(valid, x - self.shift, 0.0)
+        mask = valid.astype(float)
+        # [i, j] は列jが欠損でない行での列iの和 (二乗和も同様)
+        self.pair_n += mask.T @ mask
+        self.pair_sums += x.T @ mask
+        self.pair_squares += (x * x).T @ mask
+        self.pair_products += x.T @ x
+
+        target = (
+            self.target_encoder.encode(batch.column(TARGET_COLUMN))
+            if self.has_target
+            else None
+        )
+        for name in self.categorical:
+            if name in self.overflow:
+                continue
+            codes = self.encoders[name].encode(batch.column(name))
+            if len(self.encoders[name].levels) > GROUP_LEVELS_MAX:
+                self.overflow.add(name)
+                groups: Dict[str, Any]
+                for groups in (
+                    self.group_count,
+                    self.group_n,
+                    self.group_sums,
+                    self.group_squares,
+                    self.target_pairs,
+                ):
+                    groups.pop(name, None)
+                continue
+            self._add_groups(name, codes, x, mask, target)
+
+    def _add_groups(
+        self,
+        name: str,
+        codes: np.ndarray,
+        x: np.ndarray,
+        mask: np.ndarray,
+        target: Optional[np.ndarray],
+    ) -> None:
+        k = len(self.numeric)
+        has = codes >= 0
+        index = codes[has]
+        self.group_count[name] = _add_at(
+            self.group_count.get(name, np.zeros(0)), index, np.ones(len(index))
+        )
+        n = self.group_n.get(name, np.zeros((0, k)))
+        sums = self.group_sums.get(name, np.zeros((0, k)))
+        squares = self.group_squares.get(name, np.zeros((0, k)))
+        n_levels = int(index.max()) + 1 if len(index) else 0
+        if n_levels > len(n):
+            grow = np.zeros((n_levels - len(n), k))
+            n, sums, squares = (np.vstack([a, grow]) for a in (n, sums, squares))
+        for i in range(k):
+            n[:n_levels, i] += np.bincount(index, mask[has, i], n_levels)
+            sums[:n_levels, i] += np.bincount(index, x[has, i], n_levels)
+            squares[:n_levels, i] += np.bincount(index, x[has, i] ** 2, n_levels)
+        self.group_n[name] = n
+        self.group_sums[name] = sums
+        self.group_squares[name] = squares
+
+        if target is not None:
+            both = has & (target >= 0)
+            pairs, pair_counts = np.unique(
+                np.stack([codes[both], target[both]], axis=1),
+                axis=0,
+                return_counts=True,
+            )
+            counter = self.target_pairs.setdefault(name, {})
+            for (code, t), count in zip(pairs.tolist(), pair_counts.tolist()):
+                counter[(code, t)] = counter.get((code, t), 0) + count
+
+    def result(self) -> Summary:
+        k = len(self.numeric)
+        shift = self.shift if self.shift is not None else np.zeros(k)
+        diag = np.arange(k)
+        n = self.pair_n[diag, diag]
+        s = self.pair_sums[diag, diag]
+        ss = self.pair_squares[diag, diag]
+        mean, std = _mean_std(n, s, ss, shift)
+        columns: Dict[str, Any] = {
+            name: {"null_count": self.null_count[name]} for name in self.names
+        }
+        for i, name in enumerate(self.numeric):
+            columns[name].update(
+                {
+                    "count": int(n[i]),
+                    "min": float(self.minimum[i]) if n[i] else None,
+                    "max": float(self.maximum[i]) if n[i] else None,
+                    "mean": mean[i],
+                    "std": std[i],
+                }
+            )
+
+        groups: Dict[str, Any] = {}
+        target_counts: Dict[str, List[List[Any]]] = {}
+        target_levels = self.target_encoder.sorted_levels()
+        for name in self.group_count:
+            encoder = self.encoders[name]
+            levels = encoder.sorted_levels()
+            order = [encoder.levels[level] for level in levels]
+            count = np.zeros(len(encoder.levels))
+            count[: len(self.group_count[name])] = self.group_count[name]
+            g_n, g_s, g_ss = (
+                np.vstack([a, np.zeros((len(encoder.levels) - len(a), k))])[order]
+                for a in (
+                    self.group_n[name],
+                    self.group_sums[name],
+                    self.group_squares[name],
+                )
+            )
+            g_mean, g_std = _mean_std(g_n, g_s, g_ss, shift)
+            groups[name] = {
+                "levels": levels,
+                "count": count[order].astype(int).tolist(),
+                "values": {
+                    value: {
+                        "count": g_n[:, i].astype(int).tolist(),
+                        "mean": [m[i] for m in g_mean],
+                        "std": [d[i] for d in g_std],
+                    }
+                    for i, value in enumerate(self.numeric)
+                },
+            }
+            if self.has_target:
+                # pandasのgroupbyと同じく target, カテゴリーの順に並べる
+                counter = self.target_pairs.get(name, {})
+                target_counts[name] = []
+                for t in target_levels:
+                    for level in levels:
+                        key = (encoder.levels[level], self.target_encoder.levels[t])
+                        if key in counter:
+                            target_counts[name].append([t, level, counter[key]])
+        return {
+            "n_rows": self.n_rows,
+            "numeric": self.numeric,
+            "columns": columns,
+            "groups": groups,
+            "target_counts": target_counts,
+            "moments": {
+                "n": self.pair_n.tolist(),
+                "sums": self.pair_sums.tolist(),
+                "squares": self.pair_squares.tolist(),
+                "products": self.pair_products.tolist(),
+            },
+        }
+
+
+# 平均を引いた和・二乗和から平均と標準偏差(不偏)を求める (件数が足りなければNone)
+def _mean_std(n: np.ndarray, s: np.ndarray, ss: np.ndarray, shift: np.ndarray) -> tuple:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = shift + s / n
+        var = (ss - s * s / n) / (n - 1)
+    mean = np.where(n > 0, mean, np.nan)
+    std = np.where(n > 1, np.sqrt(np.clip(var, 0, None)), np.nan)
+    return _nullable(mean), _nullable(std)
+
+
+def _nullable(values: np.ndarray) -> Any:
+    result = values.astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
+
+
+def build_summary(path: str) -> Summary:
+    stat = os.stat(path)
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        builder = SummaryBuilder(reader.schema)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for start in range(0, max(batch.num_rows, 1), BATCH_ROWS):
+                builder.add(batch.slice(start, BATCH_ROWS))
+    summary = builder.result()
+    summary.update(source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+    return summary
+
+
+# 集計結果を返す (なければ作成する)
+def load_summary(path: str) -> Summary:
+    key = ("summary",) + file_fingerprint(path)
+    return profile_cache.get_or_load(
+        key, lambda: load_json(path, "summary.json", build_summary, SUMMARY_VERSION)
+    )
+
+
+# メモリに収まらない可能性があるため、全体を読まずに集計結果を使うファイルか
+def is_large_file(path: str) -> bool:
+    return os.path.getsize(path) > config.LARGE_FILE_BYTES
+
+
+# カテゴリーごとの数値列の件数・平均・標準偏差 (集計していない組み合わせはNone)
+def group_stats(path: str, by: str, column: str) -> Optional[Dict[str, List[Any]]]:
+    groups = load_summary(path)["groups"].get(by)
+    if groups is None or column not in groups["values"]:
+        return None
+    return dict(levels=groups["levels"], **groups["values"][column])
+
+
+# ファイル全体から一様に行を抽出して読み込む (1バッチ分ずつ処理する)
+def sample_columns(path: str, columns: List[str], n: int) -> pa.Table:
+    rng = np.random.default_rng(0)
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        total = sum(
+            reader.get_batch(i).num_rows for i in range(reader.num_record_batches)
+        )
+        rate = min(n / total, 1.0) if total else 1.0
+        parts = []
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i).select(columns)
+            keep = np.flatnonzero(rng.random(batch.num_rows) < rate)
+            parts.append(pa.Table.from_batches([batch.take(pa.array(keep))]))
+        if not parts:
+            return reader.schema.empty_table().select(columns)
+        return pa.concat_tables(parts)
@@ -0,0 +1,228 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import config
+from utils import columnar
+from utils.cache import LRUCache
+
+rows_cache = LRUCache(config.TABLE_ROWS_CACHE_MAX_BYTES, lambda rows: rows.nbytes)
+
+# DataTableのfilter_queryの演算子 (Dash公式ドキュメントの書式)
+OPERATORS = [
+    ["ge ", ">="],
+    ["le ", "<="],
+    ["lt ", "<"],
+    ["gt ", ">"],
+    ["ne ", "!="],
+    ["eq ", "="],
+    ["contains "],
+    ["datestartswith "],
+]
+
+
+def split_filter_part(filter_part: str) -> Tuple[Optional[str], Optional[str], Any]:
+    for operator_type in OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find("{") + 1 : name_part.rfind("}")]  # NOQA
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ""
+                value: Any
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', "`"):
+                    value = value_part[1:-1].replace("\\" + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # 演算子は最初の表記に揃える
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+
+# filter_queryに一致する行のマスクを作る
+def filter_mask(df: pd.DataFrame, filter_query: Optional[str]) -> np.ndarray:
+    mask = np.ones(len(df), dtype=bool)
+    if not filter_query:
+        return mask
+    for filter_part in filter_query.split(" && "):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        col = df[col_name]
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            if isinstance(filter_value, float) and not pd.api.types.is_numeric_dtype(
+                col
+            ):
+                filter_value = _filter_value_text(filter_value)
+            try:
+                part = getattr(col, operator)(filter_value)
+            except TypeError:
+                # 型が比較できない場合は一致なしとする
+                part = pd.Series(False, index=col.index)
+        elif operator == "contains":
+            part = col.astype(str).str.contains(str(filter_value), regex=False)
+        elif operator == "datestartswith":
+            part = col.astype(str).str.startswith(str(filter_value))
+        else:
+            continue
+        mask &= part.fillna(False).to_numpy(dtype=bool)
+    return mask
+
+
+def _filter_value_text(value: float) -> str:
+    return str(int(value)) if value.is_integer() else str(value)
+
+
+# 絞り込み・並び替え後の行番号を求める (条件ごとにキャッシュする)
+def query_rows(
+    df: pd.DataFrame,
+    cache_key: Tuple,
+    sort_by: Optional[List[Dict[str, str]]],
+    filter_query: Optional[str],
+) -> Optional[np.ndarray]:
+    sort_by = [s for s in sort_by or [] if s["column_id"] in df.columns]
+    if not filter_query and not sort_by:
+        return None
+
+    def compute() -> np.ndarray:
+        rows = np.flatnonzero(filter_mask(df, filter_query))
+        if sort_by:
+            keys = df[[s["column_id"] for s in sort_by]].iloc[rows]
+            rows = _sort_rows(rows, keys, sort_by)
+        return rows
+
+    key = cache_key + (
+        filter_query or "",
+        tuple((s["column_id"], s["direction"]) for s in sort_by),
+    )
+    return rows_cache.get_or_load(key, compute)
+
+
+# 並び替えに使う列 (keys, rowsと同じ順) で行番号を並べ替える
+def _sort_rows(
+    rows: np.ndarray, keys: pd.DataFrame, sort_by: List[Dict[str, str]]
+) -> np.ndarray:
+    sorted_keys = keys.reset_index(drop=True).sort_values(
+        list(keys.columns),
+        ascending=[s["direction"] == "asc" for s in sort_by],
+        kind="stable",
+        na_position="last",
+    )
+    return rows[sorted_keys.index.to_numpy()]
+
+
+# filter_queryで参照している列
+def filter_columns(filter_query: Optional[str]) -> List[str]:
+    if not filter_query:
+        return []
+    names = [split_filter_part(part)[0] for part in filter_query.split(" && ")]
+    return [name for name in dict.fromkeys(names) if name]
+
+
+# query_rows と同じ絞り込み・並び替えを列指向のコピーに対して行う
+# 絞り込み・並び替えに使う列だけをバッチごとに読むので、ファイル全体は読み込まない
+def query_file_rows(
+    path: str,
+    cache_key: Tuple,
+    sort_by: Optional[List[Dict[str, str]]],
+    filter_query: Optional[str],
+) -> Optional[np.ndarray]:
+    names = columnar.column_names(path)
+    sort_by = [s for s in sort_by or [] if s["column_id"] in names]
+    if not filter_query and not sort_by:
+        return None
+    sort_cols = [s["column_id"] for s in sort_by]
+    needed = [
+        name
+        for name in dict.fromkeys(filter_columns(filter_query) + sort_cols)
+        if name in names
+    ]
+
+    def compute() -> np.ndarray:
+        row_parts = []
+        key_parts = []
+        offset = 0
+        with pa.memory_map(columnar.ensure_columnar(path)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                df = batch.select(needed).to_pandas()
+                rows = np.flatnonzero(filter_mask(df, filter_query))
+                row_parts.append(rows + offset)
+                if sort_by:
+                    key_parts.append(df[sort_cols].iloc[rows])
+                offset += batch.num_rows
+        rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.int64)
+        if sort_by and key_parts:
+            rows = _sort_rows(rows, pd.concat(key_parts), sort_by)
+        return rows
+
+    key = cache_key + (
+        filter_query or "",
+        tuple((s["column_id"], s["direction"]) for s in sort_by),
+    )
+    return rows_cache.get_or_load(key, compute)
+
+
+# 列指向のコピーから表示中のページの行だけを読み出す
+def file_page_records(
+    path: str,
+    rows: Optional[np.ndarray],
+    page_current: int,
+    page_size: int,
+) -> Tuple[List[Dict[str, Any]], int]:
+    with pa.memory_map(columnar.ensure_columnar(path)) as source:
+        reader = pa.ipc.open_file(source)
+        batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+        offsets = np.cumsum([0] + [batch.num_rows for batch in batches])
+        total = offsets[-1] if rows is None else len(rows)
+        page_count = max(math.ceil(total / page_size), 1)
+        page_current = min(page_current or 0, page_count - 1)
+        start = page_current * page_size
+        stop = start + page_size
+        page_rows = (
+            np.arange(start, min(stop, total)) if rows is None else rows[start:stop]
+        )
+        # 行番号の小さい順にバッチから取り出し、元の順に並べ直す
+        order = np.argsort(page_rows, kind="stable")
+        sorted_rows = page_rows[order]
+        owners = np.searchsorted(offsets, sorted_rows, side="right") - 1
+        parts = [
+            batches[i].take(pa.array(sorted_rows[owners == i] - offsets[i]))
+            for i in np.unique(owners)
+        ]
+        if parts:
+            table = pa.Table.from_batches(parts)
+        else:
+            table = reader.schema.empty_table()
+        page_df = table.to_pandas()
+    page_df = page_df.iloc[np.argsort(order, kind="stable")]
+    return page_df.to_dict("records"), page_count
+
+
+# 表示中のページだけを切り出す
+def page_records(
+    df: pd.DataFrame,
+    rows: Optional[np.ndarray],
+    page_current: int,
+    page_size: int,
+) -> Tuple[List[Dict[str, Any]], int]:
+    total = len(df) if rows is None else len(rows)
+    page_count = max(math.ceil(total / page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    stop = start + page_size
+    if rows is None:
+        page_df = df.iloc[start:stop]
+    else:
+        page_df = df.iloc[rows[start:stop]]
+    return page_df.to_dict("records"), page_count
@@ -0,0 +1,5 @@
+from app import app
+
+# 本番環境ではgunicornなどのWSGIサーバーから読み込む
+# gunicorn -c gunicorn.conf.py wsgi:server
+server = app.server